@@ -11,7 +11,8 @@ env = environ.Env(
     ALLOWED_HOSTS=(list, ['*']),
     FRONTEND_ORIGIN=(str, 'http://localhost:5173'),
 )
-environ.Env.read_env(BASE_DIR / '.env')
+if (BASE_DIR / '.env').exists():  # production injects real env vars; skip the file lookup/warning
+    environ.Env.read_env(BASE_DIR / '.env')
 
 SECRET_KEY = env('SECRET_KEY')
 DEBUG = env('DEBUG')
@@ -79,23 +80,41 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 # --- CORS ---
 CORS_ALLOW_CREDENTIALS = True
-CORS_ALLOWED_ORIGINS = [env('FRONTEND_ORIGIN')]
+FRONTEND_ORIGIN = env('FRONTEND_ORIGIN')  # gateway callbacks redirect back here
+CORS_ALLOWED_ORIGINS = [FRONTEND_ORIGIN]
 # For local tools / Swagger etc. you can add extra origins in .env
 
 # --- DRF & JWT ---
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'store.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 12,
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle',
+        'store.throttling.TokenBucketThrottle',
     ],
-    'DEFAULT_THROTTLE_RATES': {
-        'anon': '200/hour',
-        'user': '2000/hour',
+}
+
+# --- Rate limiting: token buckets shared by all workers (see store/throttling.py) ---
+TOKEN_BUCKET = {
+    'STORE': 'store.throttling.SQLiteBucketStore',
+    'PATH': env('THROTTLE_DB_PATH', default=str(BASE_DIR / 'throttle.sqlite3')),
+    # tokens spent per call (everything else costs 1)
+    'COSTS': {
+        'OrderViewSet.create': 20,
+        'khalti_initiate': 10,
+        'esewa_initiate': 10,
+        'register': 10,
+        'LoginAndMergeTokenView': 5,
+    },
+    # buckets shared by every client; requests wait up to max_wait seconds (at most
+    # max_queue of them per worker) for a token and are shed with 429 after that
+    'GLOBAL': {
+        'checkout': {
+            'capacity': 60, 'rate': 30, 'max_wait': 1.0, 'max_queue': 20,
+            'endpoints': ['OrderViewSet.create', 'khalti_initiate', 'esewa_initiate'],
+        },
     },
 }
 SIMPLE_JWT = {
@@ -103,6 +122,17 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
 }
 
+# --- Display currencies (store/currency.py); everything settles in NPR ---
+# (store tunables default in store/conf.py; these dicts only set the keys that differ)
+CURRENCY = {
+    'RATES_FILE': env('EXCHANGE_RATES_FILE', default=None),  # JSON {"rates": {"USD": "133.50", ...}}
+}
+
+# --- Idempotency-Key handling (checkout / gateway initiation) ---
+IDEMPOTENCY_TTL = timedelta(hours=24)      # how long finished responses are replayed
+IDEMPOTENCY_WAIT_SECONDS = 15              # how long a duplicate waits for the in-flight original
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(seconds=60)  # in-flight claim lease; > gateway timeout (30s)
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # --- Payment gateways ---
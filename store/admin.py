@@ -1,7 +1,45 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.utils.functional import cached_property
+
+from .order_states import bulk_transition
 from .models import (League, Team, Category, Product, ProductVariant,
-                     Cart, CartItem, Address, Order, OrderItem, Payment)
+                     Cart, CartItem, Address, Order, OrderItem, Payment, PaymentQRCode, Promotion,
+                     ExchangeRate)
+
+
+# --------- helpers ----------
+class EstimatedCountPaginator(Paginator):
+    """
+    Skip the exact COUNT(*) on unfiltered changelists of big tables where the database
+    keeps an estimate (PostgreSQL's pg_class).  Elsewhere, and for filtered lists, count
+    exactly: MAX(pk) is no estimate for tables like carts whose rows are deleted all the time.
+    """
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if getattr(qs, 'query', None) is None or qs.query.where:
+            return super().count
+        model = qs.model
+        conn = connections[qs.db]
+        if conn.vendor == 'postgresql':
+            with conn.cursor() as cur:
+                cur.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [model._meta.db_table])
+                row = cur.fetchone()
+            if row and row[0] > 0:
+                return row[0]
+        return super().count
+
 
+class FastChangeListAdmin(admin.ModelAdmin):
+    """Defaults for high-volume tables: estimated totals and no second full-table COUNT."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+# --------- catalog ----------
 class ProductVariantInline(admin.TabularInline):
     model = ProductVariant
     extra = 1
@@ -9,16 +47,140 @@ class ProductVariantInline(admin.TabularInline):
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('title','category','team','price','is_active')
+    list_select_related = ('category','team')
+    list_filter = ('is_active','category')
+    search_fields = ('title','slug')
+    autocomplete_fields = ('category','team')
     prepopulated_fields = {'slug': ('title',)}
     inlines = [ProductVariantInline]
 
-admin.site.register(League)
-admin.site.register(Team)
-admin.site.register(Category)
-admin.site.register(ProductVariant)
-admin.site.register(Cart)
-admin.site.register(CartItem)
-admin.site.register(Address)
-admin.site.register(Order)
-admin.site.register(OrderItem)
-admin.site.register(Payment)
+@admin.register(League)
+class LeagueAdmin(admin.ModelAdmin):
+    search_fields = ('name',)
+
+@admin.register(Team)
+class TeamAdmin(admin.ModelAdmin):
+    list_display = ('name','league')
+    list_select_related = ('league',)
+    search_fields = ('name',)
+    autocomplete_fields = ('league',)
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    search_fields = ('name','slug')
+
+@admin.register(ProductVariant)
+class ProductVariantAdmin(FastChangeListAdmin):
+    list_display = ('sku','product','size','stock')
+    list_select_related = ('product',)
+    list_filter = ('size',)
+    search_fields = ('=sku','product__title')
+    autocomplete_fields = ('product',)
+
+@admin.register(Promotion)
+class PromotionAdmin(admin.ModelAdmin):
+    list_display = ('name','code','kind','value','product','team','league','category','starts_at','ends_at','is_active')
+    list_filter = ('is_active','kind')
+    search_fields = ('name','=code')
+    autocomplete_fields = ('product','team','league','category')
+
+
+# --------- carts ----------
+@admin.register(Cart)
+class CartAdmin(FastChangeListAdmin):
+    list_display = ('id','user','session_id','created_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('=session_id','user__username')
+
+@admin.register(CartItem)
+class CartItemAdmin(FastChangeListAdmin):
+    list_display = ('id','cart','variant','quantity')
+    list_select_related = ('cart__user','variant__product')
+    raw_id_fields = ('cart','variant')
+
+@admin.register(Address)
+class AddressAdmin(FastChangeListAdmin):
+    list_display = ('street','city','user','is_default')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+
+
+# --------- orders & payments ----------
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+    raw_id_fields = ('variant',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('variant__product')
+
+@admin.register(Order)
+class OrderAdmin(FastChangeListAdmin):
+    list_display = ('id','user','status','total','created_at')
+    list_select_related = ('user',)
+    list_filter = ('status',)
+    search_fields = ('=id','user__username')
+    raw_id_fields = ('user','address')
+    inlines = [OrderItemInline]
+    actions = ['mark_shipped','mark_delivered','cancel_orders']
+
+    def _bulk_status(self, request, queryset, frm, to):
+        ids = list(queryset.filter(status=frm).values_list('pk', flat=True))
+        results = bulk_transition(ids, to, expected=frm, by=f'admin:{request.user.pk}')
+        return sum(1 for r in results.values() if r['status'] == 'ok')
+
+    @admin.action(description='Mark selected PAID orders as shipped')
+    def mark_shipped(self, request, queryset):
+        n = self._bulk_status(request, queryset, 'PAID', 'SHIPPED')
+        self.message_user(request, f'{n} order(s) marked shipped.', messages.SUCCESS)
+
+    @admin.action(description='Mark selected SHIPPED orders as delivered')
+    def mark_delivered(self, request, queryset):
+        n = self._bulk_status(request, queryset, 'SHIPPED', 'DELIVERED')
+        self.message_user(request, f'{n} order(s) marked delivered.', messages.SUCCESS)
+
+    @admin.action(description='Cancel selected PENDING/PAID orders (restocks items)')
+    def cancel_orders(self, request, queryset):
+        ids = list(queryset.filter(status__in=['PENDING','PAID']).values_list('pk', flat=True))
+        results = bulk_transition(ids, 'CANCELLED', by=f'admin:{request.user.pk}')
+        n = sum(1 for r in results.values() if r['status'] == 'ok')
+        self.message_user(request, f'{n} order(s) cancelled.', messages.SUCCESS)
+
+@admin.register(OrderItem)
+class OrderItemAdmin(FastChangeListAdmin):
+    list_display = ('id','order','variant','price','quantity')
+    list_select_related = ('order__user','variant__product')
+    raw_id_fields = ('order','variant')
+
+@admin.register(Payment)
+class PaymentAdmin(FastChangeListAdmin):
+    list_display = ('order','provider','amount','is_verified','created_at')
+    list_filter = ('provider','is_verified')
+    search_fields = ('=order__id','reference','pidx','transaction_uuid')
+    raw_id_fields = ('order',)
+    actions = ['verify_payments']
+
+    @admin.action(description='Verify selected payments of PENDING orders (orders become PAID)')
+    def verify_payments(self, request, queryset):
+        unverified = queryset.filter(is_verified=False)
+        with transaction.atomic():
+            order_ids = list(unverified.filter(order__status='PENDING').values_list('order_id', flat=True))
+            results = bulk_transition(order_ids, 'PAID', expected='PENDING', by=f'admin:{request.user.pk}')
+            moved = [pk for pk, r in results.items() if r['status'] == 'ok']
+            n = Payment.objects.filter(order_id__in=moved, is_verified=False).update(is_verified=True)
+        self.message_user(request, f'{n} payment(s) verified, their orders are now PAID.', messages.SUCCESS)
+        skipped = unverified.count()
+        if skipped:
+            self.message_user(request, f'{skipped} payment(s) left unverified: their order is not PENDING.',
+                              messages.WARNING)
+
+@admin.register(PaymentQRCode)
+class PaymentQRCodeAdmin(admin.ModelAdmin):
+    list_display = ('payment_type','account_name','account_number','is_active','updated_at')
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('currency','npr_per_unit','decimals','is_active','updated_at')
+    list_editable = ('npr_per_unit','is_active')
+    search_fields = ('currency',)
@@ -0,0 +1,163 @@
+# store/analytics.py
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+
+from .models import DailySalesRollup, OrderItem, SalesRollupLedger
+
+# Orders that have reached PAID at some point (and therefore count as sales)
+ROLLUP_STATUSES = ('PAID', 'SHIPPED', 'DELIVERED')
+
+# rollup key field -> OrderItem lookup it is grouped by
+KEY_LOOKUPS = {
+    'date': 'day',
+    'product_id': 'variant__product_id',
+    'size': 'variant__size',
+    'team_id': 'variant__product__team_id',
+    'league_id': 'variant__product__team__league_id',
+    'category_id': 'variant__product__category_id',
+    'provider': 'order__payment__provider',
+}
+
+
+# --------------------------
+# Aggregation
+# --------------------------
+def _aggregate(items_qs):
+    """
+    GROUP BY the rollup key over an OrderItem queryset in a single query.
+    Returns {key_tuple: [units, revenue, orders]} with providers normalised to upper case
+    (gateway views store 'khalti'/'esewa', manual flows store 'KHALTI'/'ESEWA').
+    """
+    line_total = ExpressionWrapper(F('price') * F('quantity'),
+                                   output_field=DecimalField(max_digits=14, decimal_places=2))
+    rows = (items_qs
+            .annotate(day=TruncDate('order__created_at'))
+            .values(*KEY_LOOKUPS.values())
+            .annotate(units=Sum('quantity'), revenue=Sum(line_total), orders=Count('order', distinct=True))
+            .order_by())
+
+    out = defaultdict(lambda: [0, Decimal('0'), 0])
+    for r in rows:
+        key = tuple(r[lookup] for lookup in KEY_LOOKUPS.values())
+        key = key[:-1] + ((key[-1] or '').upper(),)
+        acc = out[key]
+        acc[0] += r['units'] or 0
+        acc[1] += r['revenue'] or Decimal('0')
+        acc[2] += r['orders'] or 0
+    return out
+
+
+def _key_kwargs(key):
+    """Column values for a rollup row, including the NULL-free team_key/league_key."""
+    kw = dict(zip(KEY_LOOKUPS.keys(), key))
+    kw['team_key'] = kw['team_id'] or 0
+    kw['league_key'] = kw['league_id'] or 0
+    return kw
+
+
+def _unique_lookup(key_kwargs):
+    """The uniq_daily_sales_rollup_key columns, so lookups hit the unique index."""
+    return {k: v for k, v in key_kwargs.items() if k not in ('team_id', 'league_id')}
+
+
+# --------------------------
+# Incremental updates
+# --------------------------
+def record_paid_order(order) -> bool:
+    """
+    Fold a freshly PAID order into the daily rollups.
+    Safe to call repeatedly: the ledger row makes every order count exactly once.
+    """
+    return bool(record_paid_orders([order.pk]))
+
+
+def record_paid_orders(order_ids) -> int:
+    """
+    Batch form of record_paid_order(): one ledger lookup, one bulk ledger INSERT and one
+    GROUP BY over all the orders' items, then one bump per rollup key (not per order).
+    Returns how many orders were newly rolled up.
+    """
+    ids = set(order_ids)
+    with transaction.atomic():
+        ids -= set(SalesRollupLedger.objects.filter(order_id__in=ids).values_list('order_id', flat=True))
+        if not ids:
+            return 0
+        try:
+            with transaction.atomic():
+                SalesRollupLedger.objects.bulk_create([SalesRollupLedger(order_id=oid) for oid in ids])
+        except IntegrityError:
+            # another worker rolled some of them up meanwhile: fall back to one at a time
+            return sum(record_paid_orders([oid]) for oid in ids) if len(ids) > 1 else 0
+        for key, (units, revenue, orders) in _aggregate(OrderItem.objects.filter(order_id__in=ids)).items():
+            _bump(_key_kwargs(key), units, revenue, orders)
+    return len(ids)
+
+
+def unrecord_paid_orders(order_ids) -> int:
+    """
+    Take orders that were rolled up back out (PAID -> CANCELLED): delete their ledger rows,
+    subtract their aggregates per rollup key and drop rows that no longer count any order.
+    Returns how many orders were removed.
+    """
+    with transaction.atomic():
+        ledger = SalesRollupLedger.objects.filter(order_id__in=set(order_ids))
+        ids = list(ledger.values_list('order_id', flat=True))
+        if not ids:
+            return 0
+        ledger.delete()
+        totals = _aggregate(OrderItem.objects.filter(order_id__in=ids))
+        for key, (units, revenue, orders) in totals.items():
+            _bump(_key_kwargs(key), -units, -revenue, -orders, create=False)
+        DailySalesRollup.objects.filter(date__in={key[0] for key in totals}, orders__lte=0).delete()
+    return len(ids)
+
+
+def _bump(key_kwargs, units, revenue, orders, create=True):
+
+    increments = dict(units=F('units') + units, revenue=F('revenue') + revenue, orders=F('orders') + orders)
+    row = DailySalesRollup.objects.filter(**_unique_lookup(key_kwargs))
+    if row.update(**increments) or not create:
+        return
+    try:
+        with transaction.atomic():
+            DailySalesRollup.objects.create(units=units, revenue=revenue, orders=orders, **key_kwargs)
+    except IntegrityError:
+        # another worker created the row between our UPDATE and INSERT
+        row.update(**increments)
+
+
+# --------------------------
+# Full rebuild
+# --------------------------
+@transaction.atomic
+def rebuild_rollups(start=None, end=None, batch_size=1000) -> int:
+    """
+    Recompute rollups (optionally only for order dates in [start, end]) from raw OrderItem rows.
+    Returns the number of rollup rows written.
+    """
+    rollups = DailySalesRollup.objects.all()
+    items = OrderItem.objects.filter(order__status__in=ROLLUP_STATUSES)
+    if start:
+        rollups = rollups.filter(date__gte=start)
+        items = items.filter(order__created_at__date__gte=start)
+    if end:
+        rollups = rollups.filter(date__lte=end)
+        items = items.filter(order__created_at__date__lte=end)
+
+    rollups.delete()
+    order_ids = set(items.values_list('order_id', flat=True).distinct())
+    ledger = SalesRollupLedger.objects.all()
+    if start or end:
+        ledger = ledger.filter(order_id__in=order_ids)
+    ledger.delete()
+
+    objs = [DailySalesRollup(units=u, revenue=r, orders=o, **_key_kwargs(key))
+            for key, (u, r, o) in _aggregate(items).items()]
+    DailySalesRollup.objects.bulk_create(objs, batch_size=batch_size)
+    SalesRollupLedger.objects.bulk_create([SalesRollupLedger(order_id=oid) for oid in order_ids],
+                                          batch_size=batch_size)
+    return len(objs)
@@ -0,0 +1,144 @@
+# store/audit.py
+"""
+Buffered, append-only order/payment event log (OrderEvent).
+
+    audit.record(order.id, 'order.status', frm='PENDING', to='PAID', by='khalti')
+
+record() only appends to an in-process buffer, and only once the surrounding transaction
+commits (transaction.on_commit), so a rolled-back checkout or status change leaves no
+events behind.  With AUDIT_LOG['BACKGROUND'] a daemon thread flushes the buffer with one
+bulk INSERT every FLUSH_INTERVAL seconds (or as soon as BATCH_SIZE events are waiting),
+so the request path never pays for the write.  Without it, the buffer is flushed when
+the request finishes.  Anything left is flushed at exit.
+
+If the bulk INSERT hits a bad row, the batch is written row by row: rows that violate a
+constraint (e.g. their order was deleted) or hold invalid data are dropped and logged.
+Any other failure (database locked, connection lost) puts the events back in the buffer
+for the next flush; the flusher thread drops stale connections before every flush, like
+Django does around each request.
+
+Event payloads are kept compact: short keys, no nulls, and Decimal/datetime values
+serialised by DjangoJSONEncoder.
+"""
+import atexit
+import logging
+import threading
+
+from django.core.signals import request_finished
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import conf
+from .models import OrderEvent
+
+logger = logging.getLogger(__name__)
+
+ROW_ERRORS = (IntegrityError, DataError)   # the event itself can never be written
+
+_buffer = []
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker = {'thread': None}
+
+
+def record(order_id, event, **data):
+    """Queue one event once the current transaction commits. Never touches the database."""
+    payload = {k: v for k, v in data.items() if v is not None}
+    ev = OrderEvent(order_id=order_id, event=event, data=payload, created_at=timezone.now())
+    transaction.on_commit(lambda: _enqueue([ev]))
+
+
+def _enqueue(events):
+    with _lock:
+        _buffer.extend(events)
+        pending = len(_buffer)
+    cfg = conf.get('AUDIT_LOG')
+    if cfg['BACKGROUND']:
+        _ensure_worker(cfg)
+        if pending >= cfg['BATCH_SIZE']:
+            _wakeup.set()
+
+
+def record_status(order_id, frm, to, by=None):
+    if frm != to:
+        record(order_id, 'order.status', frm=frm, to=to, by=by)
+
+
+def flush() -> int:
+    """Write everything buffered in one bulk INSERT. Returns the number of events written."""
+    with _lock:
+        batch = _buffer[:]
+        del _buffer[:]
+    if not batch:
+        return 0
+    try:
+        with transaction.atomic():
+            OrderEvent.objects.bulk_create(batch, batch_size=conf.get('AUDIT_LOG')['BATCH_SIZE'])
+        return len(batch)
+    except ROW_ERRORS:
+        return _write_one_by_one(batch)
+    except Exception:
+        logger.exception('Audit flush failed; keeping %d events for the next one', len(batch))
+        _requeue(batch)
+        return 0
+
+
+def _write_one_by_one(batch):
+    """Fallback after a failed bulk INSERT: isolate the bad rows instead of losing the batch."""
+    written = 0
+    for i, ev in enumerate(batch):
+        try:
+            with transaction.atomic():
+                ev.save(force_insert=True)
+            written += 1
+        except ROW_ERRORS:
+            logger.warning('Dropping audit event %s for order %s: %s', ev.event, ev.order_id, ev.data)
+        except Exception:
+            logger.exception('Audit flush failed; keeping %d events for the next one', len(batch) - i)
+            _requeue(batch[i:])
+            break
+    return written
+
+
+def _requeue(events):
+    with _lock:
+        _buffer[:0] = events
+
+
+def pending() -> int:
+    with _lock:
+        return len(_buffer)
+
+
+def _ensure_worker(cfg):
+    t = _worker['thread']
+    if t is not None and t.is_alive():
+        return
+    with _lock:
+        t = _worker['thread']
+        if t is not None and t.is_alive():
+            return
+        t = threading.Thread(target=_run, args=(cfg['FLUSH_INTERVAL'],), name='audit-flusher', daemon=True)
+        _worker['thread'] = t
+        t.start()
+
+
+def _run(interval):
+    while True:
+        _wakeup.wait(interval)
+        _wakeup.clear()
+        try:
+            close_old_connections()   # reconnect after a database restart instead of reusing a dead link
+            flush()
+        except Exception:
+            logger.exception('Audit flusher iteration failed')
+
+
+@receiver(request_finished)
+def _flush_after_request(sender, **kwargs):
+    if not conf.get('AUDIT_LOG')['BACKGROUND']:
+        flush()
+
+
+atexit.register(flush)
@@ -0,0 +1,114 @@
+# store/authentication.py
+"""
+JWT authentication with a bounded in-process token -> user cache.
+
+simplejwt's JWTAuthentication verifies the signature and runs a User query on every
+request.  The result only depends on the raw token bytes (until the token expires) and
+on the user row, so a verified token is cached together with a snapshot of its user
+(is_active, is_staff, ...).  Hot cart/order requests then authenticate with no
+crypto and no query.
+
+Entries live until the token's own `exp`, capped by JWT_USER_CACHE['MAX_AGE'] so that
+other workers also notice deactivations/password changes within that window.  In this
+process, any User save/delete drops that user's entries immediately.  (QuerySet.update()
+bypasses signals: call store.authentication.forget_user() after bulk user updates.)
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from . import conf
+
+
+class TokenUserCache:
+    """LRU of raw token -> (user, validated_token, expires_at), indexed by user id for invalidation."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, raw, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            hit = self._entries.get(raw)
+            if hit is None:
+                return None
+            if hit[2] <= now:
+                self._discard(raw)
+                return None
+            self._entries.move_to_end(raw)
+            return hit[0], hit[1]
+
+    def put(self, raw, user, token, expires_at, max_entries):
+        with self._lock:
+            self._discard(raw)
+            self._entries[raw] = (user, token, expires_at)
+            self._by_user.setdefault(user.pk, set()).add(raw)
+            while len(self._entries) > max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def forget_user(self, user_id):
+        with self._lock:
+            for raw in list(self._by_user.get(user_id, ())):
+                self._discard(raw)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, raw):
+        hit = self._entries.pop(raw, None)
+        if hit is not None:
+            keys = self._by_user.get(hit[0].pk)
+            if keys is not None:
+                keys.discard(raw)
+                if not keys:
+                    del self._by_user[hit[0].pk]
+
+
+token_user_cache = TokenUserCache()
+
+
+def forget_user(user_id):
+    token_user_cache.forget_user(user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """Drop-in replacement for rest_framework_simplejwt's JWTAuthentication."""
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw = self.get_raw_token(header)
+        if raw is None:
+            return None
+
+        hit = token_user_cache.get(raw)
+        if hit is not None:
+            # shallow copy: views may set attributes on request.user without leaking across requests
+            return copy.copy(hit[0]), hit[1]
+
+        token = self.get_validated_token(raw)
+        user = self.get_user(token)  # raises for missing/inactive users, nothing is cached then
+        cfg = conf.get('JWT_USER_CACHE')
+        expires_at = min(float(token['exp']), time.time() + cfg['MAX_AGE'])
+        token_user_cache.put(raw, user, token, expires_at, cfg['MAX_ENTRIES'])
+        return user, token
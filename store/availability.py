@@ -0,0 +1,202 @@
+# store/availability.py
+"""
+Per-size availability for many products / variants at once, answered from memory.
+
+The snapshot holds every variant of an active product in a few parallel arrays
+(variant id, product id, size code, stock) ordered by product, so a product's sizes are
+one contiguous slice and a variant is found by bisecting a sorted id index.  One query
+rebuilds it once it is older than AVAILABILITY_SNAPSHOT['MAX_AGE'] seconds, which bounds
+how stale an answer can be (QuerySet.update() writes from other workers included).  In
+this process, committed variant saves are patched in place and catalog_changed / product
+edits expire it.  One reader rebuilds an expired snapshot while the others keep answering
+from the old one.
+
+This is for display and cart hints only: checkout locks the variant rows and re-checks
+stock exactly (OrderViewSet.create).
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import conf
+from .models import Product, ProductVariant
+from .signals import catalog_changed
+
+SIZE_CODES = [code for code, _ in ProductVariant.SIZES]
+_SIZE_INDEX = {code: i for i, code in enumerate(SIZE_CODES)}
+UNKNOWN_SIZE = 255
+
+
+class Snapshot:
+    def __init__(self, rows, taken_at):
+        """rows: (variant_id, product_id, slug, size, stock), ordered by product."""
+        self.taken_at = taken_at                 # timezone-aware, for the response
+        self.loaded = time.monotonic()
+        self.variant = array('q')
+        self.product = array('q')
+        self.size = array('B')
+        self.stock = array('q')
+        self.slices = {}                         # slug -> (start, stop)
+        for i, (vid, pid, slug, size, stock) in enumerate(rows):
+            self.variant.append(vid)
+            self.product.append(pid)
+            self.size.append(_SIZE_INDEX.get(size, UNKNOWN_SIZE))
+            self.stock.append(stock)
+            start, _ = self.slices.get(slug, (i, i))
+            self.slices[slug] = (start, i + 1)
+        self.slugs = {pid: slug for _, pid, slug, _, _ in rows}
+        order = sorted(range(len(self.variant)), key=self.variant.__getitem__)
+        self.ids = array('q', (self.variant[i] for i in order))
+        self.pos = array('q', order)
+
+    def age(self):
+        return time.monotonic() - self.loaded
+
+    def expire(self):
+        self.loaded = float('-inf')
+
+    def position(self, variant_id):
+        i = bisect_left(self.ids, variant_id)
+        if i < len(self.ids) and self.ids[i] == variant_id:
+            return self.pos[i]
+        return None
+
+    def size_code(self, i):
+        s = self.size[i]
+        return SIZE_CODES[s] if s != UNKNOWN_SIZE else None
+
+    def product_matrix(self, slug):
+        """{size: {'variant': id, 'stock': n}} for every size the product has, or None."""
+        bounds = self.slices.get(slug)
+        if bounds is None:
+            return None
+        return {self.size_code(i): {'variant': self.variant[i], 'stock': self.stock[i]}
+                for i in range(*bounds)}
+
+    def variant_entry(self, variant_id):
+        i = self.position(variant_id)
+        if i is None:
+            return None
+        return {'product': self.slugs[self.product[i]], 'size': self.size_code(i), 'stock': self.stock[i]}
+
+    def patch(self, variant_id, product_id, size, stock):
+        """Apply one committed variant save; False if only a rebuild can reflect it."""
+        i = self.position(variant_id)
+        if i is None or self.product[i] != product_id:
+            return False
+        self.size[i] = _SIZE_INDEX.get(size, UNKNOWN_SIZE)
+        self.stock[i] = stock
+        return True
+
+
+def _load():
+    taken_at = timezone.now()
+    rows = (ProductVariant.objects
+            .filter(product__is_active=True)
+            .order_by('product_id', 'id')
+            .values_list('id', 'product_id', 'product__slug', 'size', 'stock'))
+    return Snapshot(list(rows), taken_at)
+
+
+def _max_age():
+    return conf.get('AVAILABILITY_SNAPSHOT')['MAX_AGE']
+
+
+_lock = threading.Lock()           # guards swapping / patching the snapshot
+_refresh_lock = threading.Lock()   # held by the one thread rebuilding it
+_snapshot = None
+_generation = 0                    # bumped by every patch and invalidation
+
+
+def get_snapshot():
+    snap = _snapshot
+    if snap is not None and snap.age() < _max_age():
+        return snap
+    # one thread rebuilds; the others keep answering from the expired snapshot meanwhile
+    # and only wait when there is nothing to answer from yet
+    if not _refresh_lock.acquire(blocking=snap is None):
+        return snap
+    try:
+        return _refresh()
+    finally:
+        _refresh_lock.release()
+
+
+def _refresh():
+    global _snapshot
+    snap = _snapshot
+    if snap is not None and snap.age() < _max_age():
+        return snap   # another thread rebuilt it while we waited
+    generation = _generation
+    fresh = _load()
+    with _lock:
+        if _generation != generation:
+            fresh.expire()   # a save committed during the load; use it, but rebuild next time
+        _snapshot = fresh
+    return fresh
+
+
+def invalidate():
+    """Expire the snapshot: the next reader rebuilds it, concurrent readers still get the old one."""
+    global _generation
+    with _lock:
+        _generation += 1
+        if _snapshot is not None:
+            _snapshot.expire()
+
+
+def lookup(slugs=(), variant_ids=()):
+    snap = get_snapshot()
+    products, variants, missing = {}, {}, {'products': [], 'variants': []}
+    for slug in slugs:
+        matrix = snap.product_matrix(slug)
+        if matrix is None:
+            missing['products'].append(slug)
+        else:
+            products[slug] = matrix
+    for vid in variant_ids:
+        entry = snap.variant_entry(vid)
+        if entry is None:
+            missing['variants'].append(vid)
+        else:
+            variants[str(vid)] = entry
+    return {'as_of': snap.taken_at, 'max_age': _max_age(),
+            'products': products, 'variants': variants, 'missing': missing}
+
+
+# --------------------------
+# Invalidation
+# --------------------------
+def _apply_save(variant_id, product_id, size, stock):
+    global _generation
+    with _lock:
+        _generation += 1
+        if _snapshot is not None and not _snapshot.patch(variant_id, product_id, size, stock):
+            _snapshot.expire()
+
+
+@receiver(post_save, sender=ProductVariant)
+def _variant_saved(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(invalidate)
+    else:
+        args = (instance.pk, instance.product_id, instance.size, instance.stock)
+        transaction.on_commit(lambda: _apply_save(*args))
+
+
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def _catalog_edited(sender, **kwargs):
+    transaction.on_commit(invalidate)
+
+
+@receiver(catalog_changed)
+def _catalog_changed(sender, **kwargs):
+    transaction.on_commit(invalidate)
@@ -0,0 +1,270 @@
+# store/catalog_io.py
+"""
+Streaming catalog import/export (products + variants + image paths).
+
+Row format (CSV: one row per variant, product columns repeated; JSONL: one product per
+line with a "variants" list, or the same flat shape as CSV):
+
+    slug, title, description, price, image, category (slug), team (name), league (name),
+    is_active, size, stock, sku
+"""
+import csv
+import json
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from itertools import groupby
+
+from django.db import transaction
+
+from .models import Category, Product, ProductVariant, Team
+from .signals import catalog_changed
+
+PRODUCT_FIELDS = ['slug', 'title', 'description', 'price', 'image', 'category', 'team', 'league', 'is_active']
+VARIANT_FIELDS = ['size', 'stock', 'sku']
+CSV_FIELDS = PRODUCT_FIELDS + VARIANT_FIELDS
+
+SIZE_CODES = {code for code, _ in ProductVariant.SIZES}
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+
+
+@dataclass
+class ImportReport:
+    products: int = 0
+    variants: int = 0
+    errors: list = field(default_factory=list)  # [(line, message)]
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+
+# --------------------------
+# Readers: yield (line_no, product_dict, [(line_no, variant_dict), ...])
+# --------------------------
+def _flat_to_products(rows):
+    """Group consecutive flat rows (one per variant) by slug."""
+    for slug, group in groupby(rows, key=lambda r: (r[1].get('slug') or '').strip()):
+        group = list(group)
+        line, first = group[0]
+        variants = [(ln, r) for ln, r in group if (r.get('sku') or '').strip()]
+        yield line, first, variants
+
+
+def read_csv(fh):
+    reader = csv.DictReader(fh)
+    return _flat_to_products((n, row) for n, row in enumerate(reader, start=2))
+
+
+def read_jsonl(fh):
+    def rows():
+        for n, raw in enumerate(fh, start=1):
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                obj = json.loads(raw)
+            except ValueError as e:
+                obj = {'__error__': f'invalid JSON: {e}'}
+            if not isinstance(obj, dict):
+                obj = {'__error__': 'expected a JSON object per line'}
+            yield n, obj
+
+    flat = []
+    for n, obj in rows():
+        if 'variants' in obj or '__error__' in obj:
+            yield from _flat_to_products(flat)
+            flat = []
+            yield n, obj, [(n, v) for v in obj.get('variants') or []]
+        else:
+            flat.append((n, obj))
+    yield from _flat_to_products(flat)
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def detect_format(path):
+    lower = str(path).lower()
+    if lower.endswith('.csv'):
+        return 'csv'
+    if lower.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+# --------------------------
+# Import
+# --------------------------
+class CatalogImporter:
+    """
+    Validates and upserts products/variants in chunks.
+    Category/Team/League are resolved from in-memory maps loaded once up front;
+    bad rows are reported in the ImportReport and skipped, the rest of the chunk is written.
+    """
+
+    def __init__(self, chunk_size=2000, dry_run=False):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.report = ImportReport()
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.teams = {}        # (team name, league name) -> id
+        self.teams_by_name = {}  # team name -> id, or None when ambiguous across leagues
+        for tid, name, league in Team.objects.values_list('id', 'name', 'league__name'):
+            self.teams[(name.lower(), (league or '').lower())] = tid
+            self.teams_by_name[name.lower()] = None if name.lower() in self.teams_by_name else tid
+        self.seen_slugs = set()
+        self.seen_skus = set()
+
+    def run(self, products):
+        chunk = []
+        for item in products:
+            chunk.append(item)
+            if len(chunk) >= self.chunk_size:
+                self._flush(chunk)
+                chunk = []
+        if chunk:
+            self._flush(chunk)
+        return self.report
+
+    # --- validation ---
+    def _clean_product(self, line, row):
+        if '__error__' in row:
+            return self.report.error(line, row['__error__'])
+        slug = (row.get('slug') or '').strip()
+        title = (row.get('title') or '').strip()
+        if not slug or not title:
+            return self.report.error(line, 'slug and title are required')
+        if slug in self.seen_slugs:
+            return self.report.error(line, f'duplicate slug {slug!r} in input')
+        self.seen_slugs.add(slug)
+
+        try:
+            price = Decimal(str(row.get('price')).strip())
+        except (InvalidOperation, TypeError):
+            return self.report.error(line, f'invalid price {row.get("price")!r}')
+        if price < 0:
+            return self.report.error(line, 'price must be >= 0')
+
+        category_id = self.categories.get((row.get('category') or '').strip())
+        if category_id is None:
+            return self.report.error(line, f'unknown category {row.get("category")!r}')
+
+        team_id = None
+        team = (row.get('team') or '').strip().lower()
+        if team:
+            league = (row.get('league') or '').strip().lower()
+            team_id = self.teams.get((team, league)) if league else self.teams_by_name.get(team)
+            if team_id is None:
+                return self.report.error(line, f'unknown or ambiguous team {row.get("team")!r}')
+
+        is_active = row.get('is_active', True)
+        if isinstance(is_active, str):
+            is_active = is_active.strip().lower() in TRUE_VALUES if is_active.strip() else True
+
+        return Product(slug=slug, title=title, description=row.get('description') or '', price=price,
+                       image=(row.get('image') or '').strip(), category_id=category_id,
+                       team_id=team_id, is_active=is_active)
+
+    def _clean_variant(self, line, row, slug):
+        sku = str(row.get('sku') or '').strip()
+        size = str(row.get('size') or '').strip().upper()
+        if not sku:
+            return self.report.error(line, 'sku is required')
+        if sku in self.seen_skus:
+            return self.report.error(line, f'duplicate sku {sku!r} in input')
+        if size not in SIZE_CODES:
+            return self.report.error(line, f'invalid size {row.get("size")!r} for sku {sku!r}')
+        try:
+            stock = int(row.get('stock') or 0)
+        except (TypeError, ValueError):
+            return self.report.error(line, f'invalid stock {row.get("stock")!r} for sku {sku!r}')
+        if stock < 0:
+            return self.report.error(line, f'stock must be >= 0 for sku {sku!r}')
+        self.seen_skus.add(sku)
+        return slug, ProductVariant(sku=sku, size=size, stock=stock)
+
+    # --- writing ---
+    def _flush(self, chunk):
+        products, variants = [], []  # variants: (line, slug, ProductVariant)
+        for line, prow, vrows in chunk:
+            product = self._clean_product(line, prow)
+            if product is None:
+                continue
+            products.append(product)
+            for vline, vrow in vrows:
+                cleaned = self._clean_variant(vline, vrow, product.slug)
+                if cleaned:
+                    variants.append((vline, *cleaned))
+
+        # a sku already owned by a product outside this row would silently move: reject it
+        owners = dict(ProductVariant.objects
+                      .filter(sku__in=[v.sku for _, _, v in variants])
+                      .values_list('sku', 'product__slug'))
+        ok_variants = []
+        for vline, slug, v in variants:
+            owner = owners.get(v.sku)
+            if owner is not None and owner != slug:
+                self.report.error(vline, f'sku {v.sku!r} already belongs to product {owner!r}')
+            else:
+                ok_variants.append((slug, v))
+
+        if self.dry_run or not products:
+            self.report.products += len(products)
+            self.report.variants += len(ok_variants)
+            return
+
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                products, update_conflicts=True, unique_fields=['slug'],
+                update_fields=['title', 'description', 'price', 'image', 'category', 'team', 'is_active'])
+            ids = dict(Product.objects.filter(slug__in=[p.slug for p in products]).values_list('slug', 'id'))
+            for slug, v in ok_variants:
+                v.product_id = ids[slug]
+            ProductVariant.objects.bulk_create(
+                [v for _, v in ok_variants], update_conflicts=True, unique_fields=['sku'],
+                update_fields=['product', 'size', 'stock'])
+            variant_ids = list(ProductVariant.objects
+                               .filter(sku__in=[v.sku for _, v in ok_variants]).values_list('id', flat=True))
+        catalog_changed.send(sender=Product, variant_ids=variant_ids, reason='import')
+        self.report.products += len(products)
+        self.report.variants += len(ok_variants)
+
+
+def import_catalog(fh, fmt, chunk_size=2000, dry_run=False):
+    return CatalogImporter(chunk_size=chunk_size, dry_run=dry_run).run(READERS[fmt](fh))
+
+
+# --------------------------
+# Export
+# --------------------------
+def _product_row(p):
+    return {
+        'slug': p.slug, 'title': p.title, 'description': p.description, 'price': str(p.price),
+        'image': p.image.name if p.image else '', 'category': p.category.slug,
+        'team': p.team.name if p.team else '', 'league': p.team.league.name if p.team else '',
+        'is_active': p.is_active,
+    }
+
+
+def iter_catalog(chunk_size=2000):
+    qs = (Product.objects
+          .select_related('category', 'team__league')
+          .prefetch_related('variants')
+          .order_by('id'))
+    return qs.iterator(chunk_size=chunk_size)
+
+
+def export_catalog(fh, fmt, chunk_size=2000) -> int:
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(fh, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+    for p in iter_catalog(chunk_size):
+        row = _product_row(p)
+        variants = [{'size': v.size, 'stock': v.stock, 'sku': v.sku} for v in p.variants.all()]
+        if fmt == 'csv':
+            for v in variants or [dict.fromkeys(VARIANT_FIELDS, '')]:
+                writer.writerow({**row, **v})
+        else:
+            fh.write(json.dumps({**row, 'variants': variants}, ensure_ascii=False) + '\n')
+        count += 1
+    return count
@@ -0,0 +1,99 @@
+# store/conf.py
+"""
+Store settings and the per-process cache they tune.
+
+Every store tunable has its default here, and only here.  core/settings.py overrides
+individual keys with a dict of the same name (PROMOTIONS = {'TTL': 10}), and get()
+merges the two on every call, so override_settings works in tests.
+
+Cached holds one value loaded once per process: it is reloaded once it is older than
+the setting's 'TTL' (so other workers catch up) and dropped by invalidate(), which the
+modules call from their post_save / post_delete receivers.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+DEFAULTS = {
+    # buffered order/payment event log (store/audit.py)
+    'AUDIT_LOG': {
+        'BACKGROUND': True,        # flush from a daemon thread instead of at request end
+        'FLUSH_INTERVAL': 1.0,     # seconds
+        'BATCH_SIZE': 500,         # flush early once this many events are waiting
+    },
+    # variant availability snapshot (store/availability.py)
+    'AVAILABILITY_SNAPSHOT': {
+        'MAX_AGE': 5,   # seconds; upper bound on how stale /api/variants/availability/ can be
+    },
+    # display currencies (store/currency.py); everything settles in NPR
+    'CURRENCY': {
+        'RATES_FILE': None,   # JSON {"rates": {"USD": "133.50", ...}}
+        'TTL': 300,           # seconds before a worker reloads rates edited elsewhere
+    },
+    # verified access token -> user cache (store/authentication.py)
+    'JWT_USER_CACHE': {
+        'MAX_ENTRIES': 10000,   # LRU bound per worker
+        'MAX_AGE': 300,         # seconds; caps how long other workers can miss a deactivation
+    },
+    # checkout payment options (store/payment_config.py)
+    'PAYMENT_CONFIG': {
+        'TTL': 300,            # seconds before a worker reloads QR codes edited elsewhere
+        'MAX_BASE_URLS': 16,   # hosts whose payload is kept per generation; others are rebuilt per request
+    },
+    # promotion engine (store/promotions.py)
+    'PROMOTIONS': {
+        'TTL': 60,   # seconds before a worker recompiles rules edited elsewhere (checkout always recompiles)
+    },
+    # token buckets (store/throttling.py); capacity = burst size, rate = tokens refilled per second
+    'TOKEN_BUCKET': {
+        'STORE': 'store.throttling.LocalBucketStore',
+        'MAX_ENTRIES': 100000,   # LocalBucketStore: LRU bound on client buckets per worker
+        'PRUNE_EVERY': 10000,    # SQLiteBucketStore: drop day-idle buckets every N decisions per worker
+        'ANON': {'capacity': 200, 'rate': 200 / 3600},
+        'USER': {'capacity': 2000, 'rate': 2000 / 3600},
+        'COSTS': {},    # tokens spent per call, by endpoint (everything else costs 1)
+        'GLOBAL': {},   # buckets shared by every client, see throttling.allow_request()
+    },
+}
+
+
+def get(name):
+    """DEFAULTS[name] with the keys set in settings.<name> on top."""
+    return {**DEFAULTS[name], **getattr(settings, name, {})}
+
+
+class Cached:
+    """
+    A value built by load(), kept until it is older than get(setting)['TTL'], until
+    expired(value) says so, or until invalidate().  Readers of a fresh value take no lock.
+    """
+
+    def __init__(self, load, setting, expired=None):
+        self._load = load
+        self._setting = setting
+        self._expired = expired
+        self._lock = threading.Lock()
+        self._entry = None   # (value, loaded_at)
+
+    def _fresh(self, entry):
+        return (entry is not None and time.monotonic() - entry[1] < get(self._setting)['TTL']
+                and not (self._expired and self._expired(entry[0])))
+
+    def get(self):
+        entry = self._entry
+        if self._fresh(entry):
+            return entry[0]
+        with self._lock:
+            # another thread may have reloaded it while we waited
+            if not self._fresh(self._entry):
+                self._entry = (self._load(), time.monotonic())
+            return self._entry[0]
+
+    def set(self, value):
+        with self._lock:
+            self._entry = (value, time.monotonic())
+
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
@@ -0,0 +1,209 @@
+# store/currency.py
+"""
+Display currencies.  Every price in the database, every order total and every gateway
+amount is NPR; this layer only changes what a response *shows*.
+
+Rates (NPR per unit of a foreign currency) come from CURRENCY['RATES_FILE'] (JSON) and
+the admin-managed ExchangeRate rows, which win over the file.  The merged table is loaded
+once per process; ExchangeRate save/delete drops it here and other workers reload it
+after CURRENCY['TTL'] seconds.
+
+Responses are converted after serialization: localize() collects every money field of
+the whole page in one walk, converts the amounts in one pass with a single rate and
+quantum (ROUND_HALF_UP to the currency's minor unit), then writes them back.  Carts and
+orders go through localize_cart() / localize_order(), which convert unit prices and derive
+the sums from them, so the displayed lines always add up to the displayed total.
+
+    {"rates": {"USD": "133.50", "JPY": {"npr_per_unit": "0.89", "decimals": 0}}}
+"""
+import json
+import logging
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import patch_vary_headers
+
+from . import conf
+from .models import ExchangeRate
+
+logger = logging.getLogger(__name__)
+
+BASE = 'NPR'
+
+
+# --------------------------
+# Rate table
+# --------------------------
+def _entry(npr_per_unit, decimals=2):
+    rate = Decimal(str(npr_per_unit))
+    if rate <= 0:
+        raise InvalidOperation(f'non-positive rate {rate}')
+    return rate, Decimal(1).scaleb(-int(decimals))
+
+
+def _load_file(path):
+    try:
+        with open(path, encoding='utf-8') as fh:
+            raw = json.load(fh)
+    except (OSError, ValueError):
+        logger.exception('Could not read exchange rates from %s', path)
+        return {}
+    rates = {}
+    for code, spec in raw.get('rates', raw).items():
+        try:
+            rates[code.upper()] = _entry(**spec) if isinstance(spec, dict) else _entry(spec)
+        except (InvalidOperation, TypeError, ValueError):
+            logger.warning('Skipping bad exchange rate %r: %r', code, spec)
+    return rates
+
+
+def _load():
+    path = conf.get('CURRENCY')['RATES_FILE']
+    rates = _load_file(path) if path else {}
+    for code, rate, decimals in (ExchangeRate.objects.filter(is_active=True)
+                                 .values_list('currency', 'npr_per_unit', 'decimals')):
+        rates[code.upper()] = _entry(rate, decimals)
+    rates.pop(BASE, None)
+    return rates
+
+
+_rates = conf.Cached(_load, 'CURRENCY')
+
+
+def get_rates():
+    """{code: (npr_per_unit, quantum)} for every foreign display currency."""
+    return _rates.get()
+
+
+def invalidate():
+    _rates.invalidate()
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def _rate_changed(sender, **kwargs):
+    invalidate()
+
+
+def available():
+    return [BASE, *sorted(get_rates())]
+
+
+def requested_currency(request):
+    """?currency= first, then the Accept-Currency header; unknown codes fall back to NPR."""
+    code = (request.query_params.get('currency') or request.headers.get('Accept-Currency') or BASE).strip().upper()
+    return code if code == BASE or code in get_rates() else BASE
+
+
+# --------------------------
+# Conversion
+# --------------------------
+def convert_many(amounts, code):
+    """NPR amounts -> `code`, one rate lookup for the whole list."""
+    if code == BASE:
+        return [Decimal(str(a)) for a in amounts]
+    rate, quantum = get_rates()[code]
+    return [(Decimal(str(a)) / rate).quantize(quantum, rounding=ROUND_HALF_UP) for a in amounts]
+
+
+def _collect(data, fields, refs):
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key in fields:
+                if value is not None:
+                    refs.append((data, key, value))
+            elif isinstance(value, (dict, list)):
+                _collect(value, fields, refs)
+    elif isinstance(data, list):
+        for value in data:
+            _collect(value, fields, refs)
+    return refs
+
+
+def localize(data, fields, code, in_place=True):
+    """
+    Convert every `fields` key anywhere in serialized `data` to `code`.
+    in_place=True replaces the NPR values (display-only payloads) and tags each converted
+    object with 'currency'; in_place=False leaves them and adds 'display_<field>' plus
+    'display_currency' (orders, whose NPR amounts are what gets charged).
+    """
+    if code == BASE:
+        return data
+    refs = _collect(data, frozenset(fields), [])
+    converted = convert_many([value for _, _, value in refs], code)
+    for (obj, key, value), amount in zip(refs, converted):
+        # keep the wire type (DecimalFields render as strings)
+        out = str(amount) if isinstance(value, str) else amount
+        if in_place:
+            obj[key] = out
+            obj['currency'] = code
+        else:
+            obj[f'display_{key}'] = out
+            obj['display_currency'] = code
+    return data
+
+
+def localize_cart(cart, code):
+    """
+    Convert a serialized cart so that it still adds up in `code`: only the unit prices are
+    converted (list and promoted); line totals, subtotal and total are recomputed from them
+    and the discount is subtotal - total.  Converting every amount on its own rounds each
+    one separately, and the lines would no longer sum to the totals.
+    """
+    if code == BASE or not isinstance(cart, dict) or 'items' not in cart:
+        return cart
+    items = cart['items']
+    converted = convert_many([amount for it in items for amount in (it['product_price'], it['unit_price'])], code)
+    zero = Decimal(0).quantize(get_rates()[code][1])
+    subtotal = total = zero
+    for i, it in enumerate(items):
+        price, unit = converted[2 * i:2 * i + 2]
+        line = unit * it['quantity']
+        it.update(product_price=str(price), unit_price=str(unit), sub_total=str(line), currency=code)
+        subtotal += price * it['quantity']
+        total += line
+    cart.update(subtotal=str(subtotal), discount=str(subtotal - total), cart_total=str(total), currency=code)
+    return cart
+
+
+def localize_order(order, code):
+    """
+    Add display_* amounts to a serialized order (whose NPR amounts stay: they are charged).
+    Like localize_cart(), display_total is the sum of the converted lines, not the NPR
+    total converted on its own.
+    """
+    if code == BASE or not isinstance(order, dict) or 'items' not in order:
+        return order
+    items = order['items']
+    total = Decimal(0).quantize(get_rates()[code][1])
+    for it, price in zip(items, convert_many([it['price'] for it in items], code)):
+        it.update(display_price=str(price), display_currency=code)
+        total += price * it['quantity']
+    order.update(display_total=str(total), display_currency=code)
+    return order
+
+
+class CurrencyDisplayMixin:
+    """
+    For views whose responses carry NPR amounts: set `currency_fields` (and
+    `currency_in_place = False` where the NPR amounts must stay visible, and
+    `currency_actions` to limit it to some viewset actions).  Views whose amounts depend
+    on each other override localize_response().
+    """
+    currency_fields = ()
+    currency_in_place = True
+    currency_actions = None
+
+    def localize_response(self, data, code):
+        return localize(data, self.currency_fields, code, in_place=self.currency_in_place)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if (self.currency_fields and response.status_code < 300 and getattr(response, 'data', None) is not None
+                and (self.currency_actions is None or getattr(self, 'action', None) in self.currency_actions)):
+            code = requested_currency(request)
+            self.localize_response(response.data, code)
+            response['Content-Currency'] = code
+            patch_vary_headers(response, ('Accept-Currency',))
+        return response
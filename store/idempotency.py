@@ -0,0 +1,143 @@
+# store/idempotency.py
+"""
+Idempotency-Key support for retry-prone POST endpoints.
+
+    @idempotent('checkout')
+    def create(self, request): ...
+
+First request with a key claims an IN_PROGRESS row (committed before the view runs),
+runs the view and stores its response.  A retry with the same key and body replays the
+stored response without touching the view (no stock locks, no gateway call); a retry
+arriving while the original is still running waits for it.  An IN_PROGRESS claim is a
+lease: once it is older than IDEMPOTENCY_LOCK_TIMEOUT (its worker died or timed out) the
+next request with the key takes it over.  Reusing a key with a different body is
+rejected with 422.  Responses with status >= 500 (including gateway outages the views
+report as 502) are not stored, so the retry runs the view again.  Requests without the
+header are unaffected.
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def _ttl():
+    return getattr(settings, 'IDEMPOTENCY_TTL', timedelta(hours=24))
+
+
+def _wait_seconds():
+    return getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 15)
+
+
+def _lock_timeout():
+    return getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', timedelta(seconds=60))
+
+
+def _lease_expired(rec, now):
+    return rec.state == 'IN_PROGRESS' and rec.created_at <= now - _lock_timeout()
+
+
+def fingerprint(request) -> str:
+    try:
+        body = json.dumps(request.data, sort_keys=True, default=str)
+    except (TypeError, ValueError):
+        body = repr(request.data)
+    raw = f"{request.method}\n{request.path}\n{body}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _claim(user, scope, key, fp):
+    """Return (record, created). Expired rows and stale IN_PROGRESS leases are taken over."""
+    while True:
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                rec = IdempotencyRecord.objects.create(user=user, scope=scope, key=key, fingerprint=fp,
+                                                       expires_at=now + _ttl())
+            return rec, True
+        except IntegrityError:
+            rec = IdempotencyRecord.objects.filter(user=user, scope=scope, key=key).first()
+            if rec is None:
+                continue  # the holder gave up between our INSERT and SELECT; try again
+            if rec.expires_at <= now:
+                IdempotencyRecord.objects.filter(pk=rec.pk, expires_at__lte=now).delete()
+                continue
+            if _lease_expired(rec, now):
+                # conditional delete: of several racing takers only one removes the row
+                IdempotencyRecord.objects.filter(pk=rec.pk, state='IN_PROGRESS', created_at=rec.created_at).delete()
+                continue
+            return rec, False
+
+
+def _replay(rec):
+    return Response(rec.response_body, status=rec.response_status, headers={'Idempotent-Replayed': 'true'})
+
+
+def _await_done(rec):
+    deadline = time.monotonic() + _wait_seconds()
+    delay = 0.02
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+        rec = IdempotencyRecord.objects.filter(pk=rec.pk).first()
+        if rec is None or rec.state == 'DONE':
+            return rec
+        if _lease_expired(rec, timezone.now()):
+            return None  # holder is gone: go back to _claim and take the key over
+    return False
+
+
+def idempotent(scope):
+    """Decorate a DRF view function or viewset method (the request must be authenticated)."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            request = args[0] if isinstance(args[0], Request) else args[1]
+            key = request.headers.get(HEADER)
+            if not key or not request.user.is_authenticated:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response({'detail': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'}, status=400)
+
+            fp = fingerprint(request)
+            while True:
+                rec, created = _claim(request.user, scope, key, fp)
+                if created:
+                    break
+                if rec.fingerprint != fp:
+                    return Response({'detail': f'{HEADER} was already used with a different request'}, status=422)
+                if rec.state == 'DONE':
+                    return _replay(rec)
+                done = _await_done(rec)
+                if done is False:
+                    return Response({'detail': 'A request with this Idempotency-Key is still in progress'},
+                                    status=409, headers={'Retry-After': '1'})
+                if done is not None:
+                    return _replay(done)
+                # original failed/released the key or its lease ran out: claim it ourselves
+
+            try:
+                response = view(*args, **kwargs)
+            except Exception:
+                rec.delete()
+                raise
+            if not isinstance(response, Response) or response.status_code >= 500:
+                rec.delete()  # not replayable; let the client retry for real
+                return response
+            IdempotencyRecord.objects.filter(pk=rec.pk).update(
+                state='DONE', response_status=response.status_code, response_body=response.data)
+            return response
+        return wrapper
+    return decorator
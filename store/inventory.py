@@ -0,0 +1,109 @@
+# store/inventory.py
+"""
+Bulk stock adjustments keyed by ProductVariant.sku.
+
+Each entry is {"sku": ..., "stock": n} (absolute count) or {"sku": ..., "delta": n}
+(relative change).  Rows are locked with SELECT ... FOR UPDATE, the same lock
+OrderViewSet.create takes, so warehouse syncs and checkout decrements serialise
+per row instead of overwriting each other.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import ProductVariant
+from .signals import catalog_changed
+
+# keep CASE/IN parameters under SQLite's default 999 bound-variable limit
+DEFAULT_CHUNK_SIZE = 200
+
+
+def _parse_int(value):
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError  # int() would silently truncate 1.9 to 1
+    if isinstance(value, str):
+        value = value.strip()
+    return int(value)
+
+
+def validate_entries(entries):
+    """
+    Split raw entries into ([(index, sku, kind, value)], {index: error_result}).
+    kind is 'stock' or 'delta'.
+    """
+    valid, errors, seen = [], {}, set()
+    for i, e in enumerate(entries):
+        if not isinstance(e, dict):
+            errors[i] = {'sku': None, 'status': 'invalid', 'detail': 'entry must be an object'}
+            continue
+        sku = str(e.get('sku') or '').strip()
+        if not sku:
+            errors[i] = {'sku': None, 'status': 'invalid', 'detail': 'sku is required'}
+            continue
+        has_stock = e.get('stock') not in (None, '')
+        has_delta = e.get('delta') not in (None, '')
+        if has_stock == has_delta:
+            errors[i] = {'sku': sku, 'status': 'invalid', 'detail': 'give exactly one of stock or delta'}
+            continue
+        if sku in seen:
+            errors[i] = {'sku': sku, 'status': 'invalid', 'detail': 'sku repeated in batch'}
+            continue
+        kind = 'stock' if has_stock else 'delta'
+        try:
+            value = _parse_int(e[kind])
+        except (TypeError, ValueError):
+            errors[i] = {'sku': sku, 'status': 'invalid', 'detail': f'{kind} must be an integer'}
+            continue
+        if kind == 'stock' and value < 0:
+            errors[i] = {'sku': sku, 'status': 'invalid', 'detail': 'stock must be >= 0'}
+            continue
+        seen.add(sku)
+        valid.append((i, sku, kind, value))
+    return valid, errors
+
+
+def _apply_chunk(chunk):
+    results, whens, touched = [], [], []
+    with transaction.atomic():
+        current = {sku: (vid, stock) for sku, vid, stock in
+                   ProductVariant.objects.select_for_update()
+                   .filter(sku__in=[sku for _, sku, _, _ in chunk])
+                   .values_list('sku', 'id', 'stock')}
+        for i, sku, kind, value in chunk:
+            if sku not in current:
+                results.append((i, {'sku': sku, 'status': 'not_found'}))
+                continue
+            vid, stock = current[sku]
+            new_stock = value if kind == 'stock' else stock + value
+            if new_stock < 0:
+                results.append((i, {'sku': sku, 'status': 'insufficient', 'stock': stock,
+                                    'detail': f'delta {value} would make stock negative'}))
+                continue
+            whens.append(When(sku=sku, then=Value(value) if kind == 'stock' else F('stock') + value))
+            touched.append((sku, vid))
+            results.append((i, {'sku': sku, 'status': 'updated', 'previous': stock, 'stock': new_stock}))
+        if whens:
+            (ProductVariant.objects
+             .filter(sku__in=[sku for sku, _ in touched])
+             .update(stock=Case(*whens, default=F('stock'), output_field=IntegerField())))
+    return results, [vid for _, vid in touched]
+
+
+def apply_stock_batch(entries, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Apply a batch of stock sets/deltas in chunked set-based UPDATEs.
+    Returns {'updated': n, 'results': [per-sku result, ...]} in input order.
+    catalog_changed fires once for the whole batch.
+    """
+    valid, errors = validate_entries(entries)
+    by_index = dict(errors)
+    changed_ids = []
+    for start in range(0, len(valid), chunk_size):
+        results, ids = _apply_chunk(valid[start:start + chunk_size])
+        changed_ids.extend(ids)
+        by_index.update(results)
+
+    if changed_ids:
+        catalog_changed.send(sender=ProductVariant, variant_ids=changed_ids, reason='stock')
+    return {'updated': len(changed_ids), 'results': [by_index[i] for i in range(len(entries))]}
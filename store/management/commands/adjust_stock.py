@@ -0,0 +1,37 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog_io import READERS, detect_format
+from store.inventory import DEFAULT_CHUNK_SIZE, apply_stock_batch
+
+
+class Command(BaseCommand):
+    help = "Apply a warehouse stock file (CSV or JSONL rows of sku + stock|delta) in chunked UPDATEs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(READERS), help='defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **opts):
+        fmt = opts['format'] or detect_format(opts['path'])
+        if fmt is None:
+            raise CommandError('Cannot detect format; pass --format csv|jsonl')
+
+        with open(opts['path'], newline='', encoding='utf-8') as fh:
+            if fmt == 'csv':
+                entries = list(csv.DictReader(fh))
+            else:
+                try:
+                    entries = [json.loads(line) for line in fh if line.strip()]
+                except ValueError as e:
+                    raise CommandError(f'invalid JSONL: {e}')
+
+        summary = apply_stock_batch(entries, chunk_size=opts['chunk_size'])
+        problems = [r for r in summary['results'] if r['status'] != 'updated']
+        for r in problems:
+            self.stderr.write(f"{r['sku']}: {r['status']} {r.get('detail', '')}".rstrip())
+        msg = f"Updated {summary['updated']} of {len(entries)} SKUs"
+        self.stdout.write(self.style.WARNING(msg) if problems else self.style.SUCCESS(msg))
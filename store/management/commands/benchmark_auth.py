@@ -0,0 +1,39 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from store.authentication import CachedJWTAuthentication, token_user_cache
+
+
+class Command(BaseCommand):
+    help = "Measure per-request JWT authentication overhead: simplejwt vs the cached authenticator."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000)
+
+    def handle(self, *args, **opts):
+        n = opts['iterations']
+        with transaction.atomic():
+            user = User.objects.create_user(username='__bench_auth__', password=None)
+            token = str(AccessToken.for_user(user))
+            request = APIRequestFactory().get('/api/cart/', HTTP_AUTHORIZATION=f'Bearer {token}')
+            token_user_cache.clear()
+
+            for label, auth in (('simplejwt JWTAuthentication', JWTAuthentication()),
+                                ('CachedJWTAuthentication', CachedJWTAuthentication())):
+                auth.authenticate(request)  # warm up (fills the cache for the cached variant)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    for _ in range(n):
+                        auth.authenticate(request)
+                    elapsed = time.perf_counter() - started
+                self.stdout.write(f"{label:<30} {elapsed / n * 1e6:8.1f} us/request  "
+                                  f"{len(queries) / n:.2f} queries/request")
+            token_user_cache.clear()
+            transaction.set_rollback(True)
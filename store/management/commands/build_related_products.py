@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from store.models import OrderItem, Product
+from store.recommendations import TOP_K, build_relations
+
+
+class Command(BaseCommand):
+    help = "Build the 'fans also bought' ProductRelation index from paid orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='incremental: only products in orders created on/after YYYY-MM-DD '
+                                            '(plus products that have no relations yet)')
+        parser.add_argument('--top-k', type=int, default=TOP_K)
+
+    def handle(self, *args, **opts):
+        product_ids = None
+        if opts['since']:
+            try:
+                since = parse_date(opts['since'])
+            except ValueError:
+                since = None
+            if since is None:
+                raise CommandError('--since must be YYYY-MM-DD')
+            touched = set(OrderItem.objects.filter(order__created_at__date__gte=since)
+                          .values_list('variant__product_id', flat=True).distinct())
+            cold = set(Product.objects.filter(is_active=True, relations__isnull=True)
+                       .values_list('id', flat=True))
+            product_ids = sorted(touched | cold)
+
+        written = build_relations(product_ids=product_ids, top_k=opts['top_k'])
+        scope = 'all products' if product_ids is None else f'{len(product_ids)} products'
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} relations for {scope}"))
@@ -0,0 +1,55 @@
+import gzip
+import json
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store import audit
+from store.models import OrderEvent
+
+
+class Command(BaseCommand):
+    help = ("Archive OrderEvent rows older than --days to gzip JSONL files (one per month, appended) "
+            "and delete them from the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=180, help='keep this many days in the database')
+        parser.add_argument('--archive-dir', default=str(Path(settings.BASE_DIR) / 'archive' / 'order_events'))
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **opts):
+        audit.flush()
+        cutoff = timezone.now() - timedelta(days=opts['days'])
+        old = OrderEvent.objects.filter(created_at__lt=cutoff).order_by('id')
+        if opts['dry_run']:
+            self.stdout.write(f"{old.count()} events older than {cutoff:%Y-%m-%d} would be archived")
+            return
+
+        out_dir = Path(opts['archive_dir'])
+        out_dir.mkdir(parents=True, exist_ok=True)
+        files, written, max_id = {}, 0, None
+        try:
+            for ev in old.iterator(chunk_size=opts['chunk_size']):
+                month = ev.created_at.strftime('%Y-%m')
+                fh = files.get(month)
+                if fh is None:
+                    # 'at' appends a new gzip member; readers see one continuous JSONL stream
+                    fh = files[month] = gzip.open(out_dir / f'order-events-{month}.jsonl.gz', 'at', encoding='utf-8')
+                row = {'id': ev.id, 'o': ev.order_id, 'e': ev.event, 'd': ev.data, 't': ev.created_at}
+                fh.write(json.dumps(row, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n')
+                written += 1
+                max_id = ev.id
+        finally:
+            for fh in files.values():
+                fh.close()
+
+        deleted = 0
+        if max_id is not None:
+            deleted, _ = OrderEvent.objects.filter(created_at__lt=cutoff, id__lte=max_id).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {written} events to {out_dir} ({', '.join(sorted(files)) or 'nothing'}); deleted {deleted}"))
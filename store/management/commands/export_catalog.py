@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog_io import READERS, detect_format, export_catalog
+
+
+class Command(BaseCommand):
+    help = "Stream the catalog (products, variants, image paths) to CSV or JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="output file, '-' for stdout")
+        parser.add_argument('--format', choices=sorted(READERS), help='defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        path = opts['path']
+        fmt = opts['format'] or (detect_format(path) if path != '-' else 'jsonl')
+        if fmt is None:
+            raise CommandError('Cannot detect format; pass --format csv|jsonl')
+
+        if path == '-':
+            count = export_catalog(self.stdout, fmt, chunk_size=opts['chunk_size'])
+            sys.stderr.write(f"Exported {count} products\n")
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as fh:
+            count = export_catalog(fh, fmt, chunk_size=opts['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} products to {path}"))
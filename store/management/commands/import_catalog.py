@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog_io import READERS, detect_format, import_catalog
+
+
+class Command(BaseCommand):
+    help = "Stream products/variants from a CSV or JSONL file and upsert them in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(READERS), help='defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--dry-run', action='store_true', help='validate only, write nothing')
+        parser.add_argument('--max-errors', type=int, default=50, help='how many row errors to print')
+
+    def handle(self, *args, **opts):
+        fmt = opts['format'] or detect_format(opts['path'])
+        if fmt is None:
+            raise CommandError('Cannot detect format; pass --format csv|jsonl')
+
+        started = time.perf_counter()
+        with open(opts['path'], newline='', encoding='utf-8') as fh:
+            report = import_catalog(fh, fmt, chunk_size=opts['chunk_size'], dry_run=opts['dry_run'])
+        elapsed = time.perf_counter() - started
+
+        for line, message in report.errors[:opts['max_errors']]:
+            self.stderr.write(f"line {line}: {message}")
+        if len(report.errors) > opts['max_errors']:
+            self.stderr.write(f"... {len(report.errors) - opts['max_errors']} more errors")
+
+        verb = 'Validated' if opts['dry_run'] else 'Imported'
+        msg = (f"{verb} {report.products} products / {report.variants} variants "
+               f"in {elapsed:.1f}s ({len(report.errors)} errors)")
+        self.stdout.write(self.style.WARNING(msg) if report.errors else self.style.SUCCESS(msg))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.startup import LAZY_MODULES, measure_startup, top_level_totals
+
+
+class Command(BaseCommand):
+    help = "Boot a fresh worker process and report time-to-ready and per-module import time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help='how many modules/packages to list')
+        parser.add_argument('--runs', type=int, default=3, help='boot this many times and report the best')
+        parser.add_argument('--budget', type=float, help='exit non-zero if start-up exceeds this many seconds')
+
+    def handle(self, *args, **opts):
+        best = min((measure_startup() for _ in range(max(1, opts['runs']))), key=lambda r: r['seconds'])
+        profile = measure_startup(importtime=True)
+
+        self.stdout.write(f"Time to ready (best of {opts['runs']}): {best['seconds'] * 1000:.1f} ms, "
+                          f"{len(best['modules'])} modules loaded")
+
+        self.stdout.write("\nSlowest modules (cumulative ms, self ms):")
+        for name, self_us, cum_us in sorted(profile['imports'], key=lambda r: -r[2])[:opts['top']]:
+            self.stdout.write(f"  {cum_us / 1000:8.1f} {self_us / 1000:8.1f}  {name}")
+
+        self.stdout.write("\nSelf time per top-level package (ms):")
+        for root, us in top_level_totals(profile['imports'])[:opts['top']]:
+            self.stdout.write(f"  {us / 1000:8.1f}  {root}")
+
+        eager = [m for m in LAZY_MODULES if m in best['modules']]
+        if eager:
+            self.stdout.write(self.style.WARNING(f"\nImported at start-up but meant to be lazy: {', '.join(eager)}"))
+
+        if opts['budget'] is not None and best['seconds'] > opts['budget']:
+            raise CommandError(f"Start-up took {best['seconds']:.3f}s, budget is {opts['budget']:.3f}s")
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from store.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild DailySalesRollup rows from raw OrderItem/Payment data."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='first order date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--end', help='last order date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **opts):
+        start = self._date(opts['start'], '--start')
+        end = self._date(opts['end'], '--end')
+        written = rebuild_rollups(start=start, end=end, batch_size=opts['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} rollup rows"))
+
+    def _date(self, value, flag):
+        if not value:
+            return None
+        try:
+            d = parse_date(value)
+        except ValueError:
+            d = None
+        if d is None:
+            raise CommandError(f"{flag} must be YYYY-MM-DD")
+        return d
@@ -1,7 +1,8 @@
 # store/models.py
 from django.db import models
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import User
-from rest_framework import serializers
 
 
 # ==================== CORE MODELS ====================
@@ -100,7 +101,7 @@ class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     address = models.ForeignKey(Address, on_delete=models.SET_NULL, null=True)
     total = models.DecimalField(max_digits=10, decimal_places=2)
-    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING', db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
@@ -128,10 +129,10 @@ class Payment(models.Model):
     ]
     
     order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='payment')
-    provider = models.CharField(max_length=20, choices=PAYMENT_METHODS)
+    provider = models.CharField(max_length=20, choices=PAYMENT_METHODS, db_index=True)
     reference = models.CharField(max_length=120, blank=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    is_verified = models.BooleanField(default=False)
+    is_verified = models.BooleanField(default=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     # Gateway metadata
@@ -173,4 +174,185 @@ class PaymentQRCode(models.Model):
     
     class Meta:
         verbose_name = 'Payment QR Code'
-        verbose_name_plural = 'Payment QR Codes'
\ No newline at end of file
+        verbose_name_plural = 'Payment QR Codes'
+
+# ==================== AUDIT LOG ====================
+
+class OrderEvent(models.Model):
+    """
+    Append-only history of order/payment state transitions and raw gateway responses.
+    Written in batches by store.audit; never updated in place.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='events')
+    event = models.CharField(max_length=40)   # e.g. order.status, gateway.khalti.lookup
+    data = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.event} for Order {self.order_id}"
+
+    class Meta:
+        indexes = [models.Index(fields=['order', 'created_at'])]
+
+
+# ==================== IDEMPOTENCY ====================
+
+class IdempotencyRecord(models.Model):
+    """
+    Stored outcome of a request sent with an Idempotency-Key header (see store.idempotency).
+    IN_PROGRESS rows block concurrent duplicates; DONE rows are replayed until expires_at.
+    """
+    STATES = [('IN_PROGRESS', 'In progress'), ('DONE', 'Done')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    scope = models.CharField(max_length=50)  # endpoint name, so one key can't replay another endpoint
+    fingerprint = models.CharField(max_length=64)  # sha256 of method + path + body
+    state = models.CharField(max_length=12, choices=STATES, default='IN_PROGRESS')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.state})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='uniq_idempotency_key'),
+        ]
+
+
+# ==================== PROMOTIONS ====================
+
+class Promotion(models.Model):
+    """
+    A sale or coupon: PERCENT or FIXED (NPR) off the product price.  Scope is at most one of
+    product / team / league / category (none = whole catalog).  Rules with a `code` only
+    apply when that coupon is given.  Rules don't stack: each product gets the lowest price.
+    """
+    KINDS = [
+        ('PERCENT', 'Percent off'),
+        ('FIXED', 'Amount off (NPR)'),
+    ]
+
+    name = models.CharField(max_length=100)
+    code = models.CharField(max_length=40, blank=True, db_index=True, help_text='Coupon code; leave blank for an automatic sale')
+    kind = models.CharField(max_length=10, choices=KINDS, default='PERCENT')
+    value = models.DecimalField(max_digits=10, decimal_places=2)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True)
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, null=True, blank=True)
+    league = models.ForeignKey(League, on_delete=models.CASCADE, null=True, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+    starts_at = models.DateTimeField(null=True, blank=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.code})" if self.code else self.name
+
+    def clean(self):
+        if sum(1 for f in ('product_id', 'team_id', 'league_id', 'category_id') if getattr(self, f)) > 1:
+            raise ValidationError('Scope a promotion to at most one of product, team, league or category.')
+        if self.value is not None and (self.value <= 0 or (self.kind == 'PERCENT' and self.value > 100)):
+            raise ValidationError({'value': 'Must be positive (and at most 100 for a percentage).'})
+        if self.starts_at and self.ends_at and self.ends_at <= self.starts_at:
+            raise ValidationError({'ends_at': 'Must be after starts_at.'})
+        self.code = self.code.strip().upper()
+
+
+# ==================== CURRENCY ====================
+
+class ExchangeRate(models.Model):
+    """Display-only rate: how many NPR one unit of `currency` costs.  Payments always settle in NPR."""
+    currency = models.CharField(max_length=3, unique=True, help_text='ISO 4217 code, e.g. USD')
+    npr_per_unit = models.DecimalField(max_digits=12, decimal_places=4)
+    decimals = models.PositiveSmallIntegerField(default=2, help_text='Minor units shown (JPY: 0)')
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"1 {self.currency} = {self.npr_per_unit} NPR"
+
+    def clean(self):
+        self.currency = self.currency.strip().upper()
+        if self.npr_per_unit is not None and self.npr_per_unit <= 0:
+            raise ValidationError({'npr_per_unit': 'Must be positive.'})
+
+
+# ==================== RECOMMENDATION MODELS ====================
+
+class ProductRelation(models.Model):
+    """Precomputed top-K "fans also bought" neighbours; rebuilt by `manage.py build_related_products`."""
+    SOURCES = [
+        ('COPURCHASE', 'Bought together'),
+        ('TEAM', 'Same team'),
+        ('LEAGUE', 'Same league'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='relations')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.PositiveIntegerField(default=0)  # co-purchase order count (0 for fallbacks)
+    source = models.CharField(max_length=12, choices=SOURCES)
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} (#{self.rank})"
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='uniq_product_relation_rank'),
+        ]
+
+
+# ==================== ANALYTICS MODELS ====================
+
+class DailySalesRollup(models.Model):
+    """
+    Pre-aggregated sales per day x product x size x team x league x category x provider.
+    Maintained incrementally by store.analytics when an order reaches PAID and
+    rebuildable from raw OrderItem rows with `manage.py rebuild_sales_rollups`.
+    """
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    size = models.CharField(max_length=10)
+    team = models.ForeignKey(Team, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    league = models.ForeignKey(League, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    provider = models.CharField(max_length=20, blank=True)  # '' when the order has no payment row
+    # team_id / league_id with 0 for "none": NULLs are distinct in a UNIQUE constraint, so the
+    # nullable FKs can't be part of the key without letting concurrent first inserts duplicate rows
+    team_key = models.PositiveBigIntegerField(default=0)
+    league_key = models.PositiveBigIntegerField(default=0)
+
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)  # orders contributing to this row (not additive across rows)
+
+    def __str__(self):
+        return f"{self.date} {self.product_id}/{self.size} x{self.units}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'product', 'size', 'team_key', 'league_key', 'category', 'provider'],
+                name='uniq_daily_sales_rollup_key',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'team']),
+            models.Index(fields=['date', 'league']),
+            models.Index(fields=['date', 'category']),
+            models.Index(fields=['date', 'provider']),
+        ]
+
+
+class SalesRollupLedger(models.Model):
+    """One row per order already folded into DailySalesRollup, so re-marking PAID never double counts."""
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    rolled_up_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Rollup ledger for Order {self.order_id}"
@@ -0,0 +1,137 @@
+# store/order_states.py
+"""
+Order status state machine over Order.STATUS_CHOICES.
+
+    PENDING -> PAID -> SHIPPED -> DELIVERED
+       \\          \\
+        +-> CANCELLED <-+
+
+Every status write goes through here so transitions are validated, conditional
+(`UPDATE ... WHERE status = <expected>`), audited, and have their side effects applied:
+PAID feeds the sales rollups, CANCELLED puts the ordered quantities back in stock (and
+takes a PAID order back out of the rollups).
+bulk_transition() does the same for thousands of orders with a handful of set-based
+queries per chunk.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, When
+
+from . import audit
+from .analytics import record_paid_orders, unrecord_paid_orders
+from .models import Order, OrderItem, ProductVariant
+from .signals import catalog_changed
+
+TRANSITIONS = {
+    'PENDING': {'PAID', 'CANCELLED'},
+    'PAID': {'SHIPPED', 'CANCELLED'},
+    'SHIPPED': {'DELIVERED'},
+    'DELIVERED': set(),
+    'CANCELLED': set(),
+}
+STATUSES = {code for code, _ in Order.STATUS_CHOICES}
+
+CHUNK_SIZE = 500           # order ids per chunk (stays under SQLite's 999 variables)
+STOCK_CHUNK_SIZE = 200     # variants per CASE UPDATE when restoring stock
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+class _ChunkMoved(Exception):
+    """Orders of a bulk chunk changed status between its SELECT and UPDATE."""
+
+
+def can_transition(frm, to):
+    return to in TRANSITIONS.get(frm, ())
+
+
+def _restore_stock(order_ids):
+    """Give the items of cancelled orders back to stock in chunked CASE UPDATEs."""
+    qty = dict(OrderItem.objects.filter(order_id__in=order_ids)
+               .values_list('variant_id').annotate(n=Sum('quantity')).order_by())
+    ids = sorted(qty)
+    for start in range(0, len(ids), STOCK_CHUNK_SIZE):
+        chunk = ids[start:start + STOCK_CHUNK_SIZE]
+        ProductVariant.objects.filter(pk__in=chunk).update(stock=Case(
+            *[When(pk=vid, then=F('stock') + qty[vid]) for vid in chunk],
+            default=F('stock'), output_field=IntegerField()))
+    if ids:
+        catalog_changed.send(sender=ProductVariant, variant_ids=ids, reason='restock')
+
+
+def _after(order_ids, frm, to, by):
+    for pk in order_ids:
+        audit.record_status(pk, frm, to, by=by)
+    if to == 'CANCELLED':
+        if frm == 'PAID':
+            unrecord_paid_orders(order_ids)
+        _restore_stock(order_ids)
+    elif to == 'PAID':
+        record_paid_orders(order_ids)
+
+
+@transaction.atomic
+def transition(order, to, by=None):
+    """
+    Move one order to `to`. Returns False if it already is there, raises InvalidTransition
+    if the move is not allowed or the row changed under us.  Updates order.status in place.
+    """
+    frm = order.status
+    if frm == to:
+        return False
+    if not can_transition(frm, to):
+        raise InvalidTransition(f'Cannot move order {order.pk} from {frm} to {to}')
+    if not Order.objects.filter(pk=order.pk, status=frm).update(status=to):
+        raise InvalidTransition(f'Order {order.pk} is no longer {frm}')
+    order.status = to
+    _after([order.pk], frm, to, by)
+    return True
+
+
+def bulk_transition(order_ids, to, expected=None, by=None, chunk_size=CHUNK_SIZE):
+    """
+    Move many orders to `to` with conditional set-based UPDATEs.
+    `expected` restricts the source status (e.g. only PAID -> SHIPPED).
+    Returns {order_id: {'status': 'ok' | 'noop' | 'invalid' | 'conflict' | 'not_found', 'from': ...}}.
+    """
+    if to not in STATUSES:
+        raise InvalidTransition(f'Unknown status {to}')
+    ids = list(dict.fromkeys(int(i) for i in order_ids))
+    results = {}
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        try:
+            results.update(_bulk_chunk(chunk, to, expected, by))
+        except _ChunkMoved:
+            # another worker moved some of them first; the chunk was rolled back as a whole
+            results.update({pk: {'status': 'conflict'} for pk in chunk})
+    return results
+
+
+@transaction.atomic
+def _bulk_chunk(ids, to, expected, by):
+    current = dict(Order.objects.select_for_update().filter(pk__in=ids).values_list('pk', 'status'))
+    results, movable = {}, defaultdict(list)
+    for pk in ids:
+        frm = current.get(pk)
+        if frm is None:
+            results[pk] = {'status': 'not_found'}
+        elif expected and frm != expected:
+            results[pk] = {'status': 'conflict', 'from': frm}
+        elif frm == to:
+            results[pk] = {'status': 'noop', 'from': frm}
+        elif not can_transition(frm, to):
+            results[pk] = {'status': 'invalid', 'from': frm}
+        else:
+            movable[frm].append(pk)
+
+    for frm, pks in movable.items():
+        if Order.objects.filter(pk__in=pks, status=frm).update(status=to) != len(pks):
+            raise _ChunkMoved  # like transition(): never apply side effects for rows we did not move
+        _after(pks, frm, to, by)
+        for pk in pks:
+            results[pk] = {'status': 'ok', 'from': frm}
+    return results
@@ -0,0 +1,80 @@
+# store/payment_config.py
+"""
+In-process cache of checkout payment options (active PaymentQRCode rows + public gateway settings).
+
+The rows change about once a month but are read on every checkout page view, so the first
+read loads them once per process and every later read is a dict lookup.  PaymentQRCode
+save/delete signals drop the cache in this process; other workers pick the change up
+within PAYMENT_CONFIG['TTL'] seconds.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import conf
+from .models import Payment, PaymentQRCode
+
+
+def _load_qr_codes():
+    codes = {
+        qr.payment_type: {
+            'payment_type': qr.payment_type,
+            'label': qr.get_payment_type_display(),
+            'qr_code': qr.qr_code.url if qr.qr_code else None,
+            'account_name': qr.account_name,
+            'account_number': qr.account_number,
+            'instructions': qr.instructions,
+            'updated_at': qr.updated_at.isoformat(),
+        }
+        for qr in PaymentQRCode.objects.filter(is_active=True).order_by('payment_type')
+    }
+    return codes, {}   # the rows, and payment_options() payloads built from them per base_url
+
+
+_cache = conf.Cached(_load_qr_codes, 'PAYMENT_CONFIG')
+
+
+def _qr_codes():
+    return _cache.get()
+
+
+def invalidate():
+    _cache.invalidate()
+
+
+@receiver(post_save, sender=PaymentQRCode)
+@receiver(post_delete, sender=PaymentQRCode)
+def _qr_changed(sender, **kwargs):
+    invalidate()
+
+
+def _absolute(base_url, url):
+    if not url or url.startswith(('http://', 'https://')):
+        return url
+    return base_url + url
+
+
+def payment_options(base_url=''):
+    """
+    Public checkout payload with absolute image URLs for base_url ('https://host').
+    Returns (payload, etag); both are precomputed once per base_url per cache generation.
+    base_url comes from the request's Host header, so only the first
+    PAYMENT_CONFIG['MAX_BASE_URLS'] of them are kept; any others are built per call.
+    """
+    qr, by_base = _qr_codes()
+    cached = by_base.get(base_url)
+    if cached is not None:
+        return cached
+
+    codes = {k: {**v, 'qr_code': _absolute(base_url, v['qr_code'])} for k, v in qr.items()}
+    payload = {
+        'methods': [{'code': code, 'label': label, 'qr': codes.get(code)} for code, label in Payment.PAYMENT_METHODS],
+        'esewa': {'form_url': settings.ESEWA_FORM_URL, 'product_code': settings.ESEWA_PRODUCT_CODE},
+    }
+    etag = '"%s"' % hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+    if len(by_base) < conf.get('PAYMENT_CONFIG')['MAX_BASE_URLS']:
+        by_base[base_url] = (payload, etag)   # belongs to this generation; invalidate() starts a new dict
+    return payload, etag
@@ -0,0 +1,214 @@
+# store/promotions.py
+"""
+Promotion engine: Promotion rows compiled into lookup tables, prices evaluated in batch.
+
+Compiling turns the rules that are live right now into dicts keyed by what a product
+carries itself -- product id, team id (league rules are expanded to their teams), category
+id -- plus a catalog-wide list, and the same per coupon code.  Pricing a listing page or
+a cart is then a few dict lookups per product, with no query.  The compiled engine
+is rebuilt when a Promotion/Team row changes in this process, when the next rule starts
+or ends, and after PROMOTIONS['TTL'] seconds (so other workers catch up).  Checkout
+always prices with a freshly compiled engine.
+
+price_expression() is the same rule set as a SQL expression, for filtering and
+ordering product lists by effective price in the database.
+"""
+from collections import defaultdict, namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Q, Value, When
+from django.db.models.functions import Greatest, Least, Round
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import conf
+from .models import Promotion, Team
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+_PRICE_FIELD = DecimalField(max_digits=10, decimal_places=2)
+
+Rule = namedtuple('Rule', 'id name kind value scope scope_id')
+Price = namedtuple('Price', 'price promotion')      # promotion: Rule or None
+Quote = namedtuple('Quote', 'lines subtotal total discount coupon_valid')
+
+
+def normalize_code(code):
+    return (code or '').strip().upper()
+
+
+def apply_rule(rule, price):
+    if rule.kind == 'PERCENT':
+        return price - (price * rule.value / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+    return max(price - rule.value, ZERO)
+
+
+# --------------------------
+# Compiled rules
+# --------------------------
+class Tables:
+    """One set of lookup tables (automatic sales, or one coupon code)."""
+
+    def __init__(self):
+        self.product = defaultdict(list)
+        self.team = defaultdict(list)
+        self.category = defaultdict(list)
+        self.everything = []
+        self.rules = []
+        self.league_teams = {}   # league rule id -> team ids, for the SQL expression
+
+    def add(self, rule, team_ids=()):
+        if rule.scope == 'league':
+            if not team_ids:
+                return
+            self.league_teams[rule.id] = list(team_ids)
+        self.rules.append(rule)
+        if rule.scope == 'product':
+            self.product[rule.scope_id].append(rule)
+        elif rule.scope == 'team':
+            self.team[rule.scope_id].append(rule)
+        elif rule.scope == 'league':
+            for tid in team_ids:
+                self.team[tid].append(rule)
+        elif rule.scope == 'category':
+            self.category[rule.scope_id].append(rule)
+        else:
+            self.everything.append(rule)
+
+    def candidates(self, product):
+        return (self.product.get(product.pk, []) + self.team.get(product.team_id, [])
+                + self.category.get(product.category_id, []) + self.everything)
+
+
+class Engine:
+    def __init__(self, promotions, team_leagues, now):
+        self.sales = Tables()
+        self.coupons = defaultdict(Tables)
+        self.valid_until = None   # datetime of the next start/end, when a recompile is due
+        teams_by_league = defaultdict(list)
+        for tid, lid in team_leagues:
+            teams_by_league[lid].append(tid)
+
+        for p in promotions:
+            for edge in (p.starts_at, p.ends_at):
+                if edge and edge > now and (self.valid_until is None or edge < self.valid_until):
+                    self.valid_until = edge
+            if (p.starts_at and p.starts_at > now) or (p.ends_at and p.ends_at <= now):
+                continue
+            scope = next(((s, getattr(p, f'{s}_id')) for s in ('product', 'team', 'league', 'category')
+                          if getattr(p, f'{s}_id')), (None, None))
+            rule = Rule(p.pk, p.name, p.kind, p.value, *scope)
+            tables = self.coupons[normalize_code(p.code)] if p.code else self.sales
+            tables.add(rule, teams_by_league.get(rule.scope_id, ()) if rule.scope == 'league' else ())
+
+    def is_stale(self):
+        """A rule started or ended since compiling."""
+        return self.valid_until is not None and timezone.now() >= self.valid_until
+
+    def has_code(self, code):
+        return normalize_code(code) in self.coupons
+
+    def _tables(self, code):
+        coupon = self.coupons.get(normalize_code(code)) if code else None
+        return [self.sales, coupon] if coupon else [self.sales]
+
+    def evaluate(self, products, code=None):
+        """{product_id: Price} for an iterable of products (needs price, team_id, category_id)."""
+        tables = self._tables(code)
+        out = {}
+        for product in products:
+            best, rule = product.price, None
+            for t in tables:
+                for r in t.candidates(product):
+                    p = apply_rule(r, product.price)
+                    if p < best:
+                        best, rule = p, r
+            out[product.pk] = Price(best, rule)
+        return out
+
+    def expression(self, code=None):
+        """SQL for the effective price of a Product row, mirroring evaluate()."""
+        terms = []
+        for t in self._tables(code):
+            for r in t.rules:
+                terms.append(Case(When(self._match(t, r), then=_sql_price(r)), default=F('price'),
+                                  output_field=_PRICE_FIELD))
+        if not terms:
+            return ExpressionWrapper(F('price'), output_field=_PRICE_FIELD)
+        return Least(F('price'), *terms, output_field=_PRICE_FIELD)
+
+    @staticmethod
+    def _match(tables, rule):
+        if rule.scope == 'product':
+            return Q(pk=rule.scope_id)
+        if rule.scope == 'team':
+            return Q(team_id=rule.scope_id)
+        if rule.scope == 'league':
+            return Q(team_id__in=tables.league_teams[rule.id])
+        if rule.scope == 'category':
+            return Q(category_id=rule.scope_id)
+        return Q(pk__isnull=False)
+
+
+def _sql_price(rule):
+    if rule.kind == 'PERCENT':
+        off = Round(F('price') * Value(rule.value) / Value(100), 2)
+        return ExpressionWrapper(F('price') - off, output_field=_PRICE_FIELD)
+    return Greatest(F('price') - Value(rule.value), Value(ZERO), output_field=_PRICE_FIELD)
+
+
+def compile_engine():
+    now = timezone.now()
+    promotions = list(Promotion.objects.filter(is_active=True).order_by('pk'))
+    league_ids = {p.league_id for p in promotions if p.league_id}
+    team_leagues = Team.objects.filter(league_id__in=league_ids).values_list('id', 'league_id') if league_ids else ()
+    return Engine(promotions, team_leagues, now)
+
+
+_engine = conf.Cached(compile_engine, 'PROMOTIONS', expired=Engine.is_stale)
+
+
+def get_engine(fresh=False):
+    """The compiled rules; fresh=True recompiles from the database (checkout)."""
+    if fresh:
+        engine = compile_engine()
+        _engine.set(engine)
+        return engine
+    return _engine.get()
+
+
+def invalidate():
+    _engine.invalidate()
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def _rules_changed(sender, **kwargs):
+    invalidate()
+
+
+# --------------------------
+# Batch pricing
+# --------------------------
+def evaluate(products, code=None, engine=None):
+    return (engine or get_engine()).evaluate(products, code)
+
+
+def price_expression(code=None):
+    return get_engine().expression(code)
+
+
+def quote(items, code=None, engine=None):
+    """
+    Price cart lines (objects with .variant.product and .quantity) in one pass.
+    Returns Quote(lines=[(item, Price)], subtotal, total, discount, coupon_valid).
+    """
+    engine = engine or get_engine()
+    prices = engine.evaluate({it.variant.product.pk: it.variant.product for it in items}.values(), code)
+    lines = [(it, prices[it.variant.product.pk]) for it in items]
+    subtotal = sum((it.quantity * it.variant.product.price for it in items), ZERO)
+    total = sum((it.quantity * p.price for it, p in lines), ZERO)
+    return Quote(lines, subtotal, total, subtotal - total, engine.has_code(code) if code else None)
@@ -0,0 +1,95 @@
+# store/recommendations.py
+"""
+"Fans also bought" index.
+
+Co-purchase counts come from one streamed pass over (order, product) pairs of paid
+orders, accumulated as a sparse product x product counter (baskets are small, so this
+is O(sum of basket_size^2)).  Products with fewer than TOP_K co-purchase neighbours are
+topped up with same-team, then same-league products, so new products are never empty.
+"""
+from collections import Counter, defaultdict
+from itertools import combinations, groupby
+from operator import itemgetter
+
+from django.db import transaction
+
+from .analytics import ROLLUP_STATUSES
+from .models import OrderItem, Product, ProductRelation
+
+TOP_K = 8
+MAX_BASKET = 50  # bulk/wholesale orders say nothing about taste and are quadratic to count
+
+
+def count_copurchases(product_ids=None):
+    """Sparse {product_id: Counter(other_product_id -> orders bought together)}."""
+    items = OrderItem.objects.filter(order__status__in=ROLLUP_STATUSES)
+    if product_ids is not None:
+        items = items.filter(order_id__in=OrderItem.objects
+                             .filter(variant__product_id__in=product_ids).values('order_id'))
+    pairs = (items.values_list('order_id', 'variant__product_id')
+             .distinct().order_by('order_id').iterator(chunk_size=5000))
+
+    counts = defaultdict(Counter)
+    for _, group in groupby(pairs, key=itemgetter(0)):
+        basket = sorted({pid for _, pid in group})
+        if len(basket) < 2 or len(basket) > MAX_BASKET:
+            continue
+        for a, b in combinations(basket, 2):
+            counts[a][b] += 1
+            counts[b][a] += 1
+    return counts
+
+
+def _catalog_groups():
+    active, by_team, by_league = {}, defaultdict(list), defaultdict(list)
+    rows = (Product.objects.filter(is_active=True)
+            .values_list('id', 'team_id', 'team__league_id').order_by('-created_at', '-id'))
+    for pid, team_id, league_id in rows:
+        active[pid] = (team_id, league_id)
+        if team_id:
+            by_team[team_id].append(pid)
+        if league_id:
+            by_league[league_id].append(pid)
+    return active, by_team, by_league
+
+
+def neighbours_for(pid, counts, active, by_team, by_league, top_k=TOP_K):
+    """[(related_id, score, source)] best first."""
+    picked, seen = [], {pid}
+    ranked = sorted(counts.get(pid, {}).items(), key=lambda kv: (-kv[1], kv[0]))
+    for other, n in ranked:
+        if other in active and other not in seen:
+            picked.append((other, n, 'COPURCHASE'))
+            seen.add(other)
+            if len(picked) == top_k:
+                return picked
+
+    team_id, league_id = active.get(pid, (None, None))
+    for source, pool in (('TEAM', by_team.get(team_id, ())), ('LEAGUE', by_league.get(league_id, ()))):
+        for other in pool:
+            if other not in seen:
+                picked.append((other, 0, source))
+                seen.add(other)
+                if len(picked) == top_k:
+                    return picked
+    return picked
+
+
+@transaction.atomic
+def build_relations(product_ids=None, top_k=TOP_K, batch_size=2000) -> int:
+    """Rebuild ProductRelation for product_ids (default: every active product). Returns rows written."""
+    counts = count_copurchases(product_ids)
+    active, by_team, by_league = _catalog_groups()
+    targets = active.keys() if product_ids is None else [p for p in product_ids if p in active]
+
+    old = ProductRelation.objects.all()
+    if product_ids is not None:
+        old = old.filter(product_id__in=product_ids)
+    old.delete()
+
+    rows = [ProductRelation(product_id=pid, related_id=other, rank=rank, score=score, source=source)
+            for pid in targets
+            for rank, (other, score, source) in enumerate(
+                neighbours_for(pid, counts, active, by_team, by_league, top_k), start=1)]
+    ProductRelation.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
@@ -1,6 +1,7 @@
 from rest_framework import serializers
+from . import promotions
 from .models import (League, Team, Category, Product, ProductVariant,
-                     Cart, CartItem, Address, Order, OrderItem, Payment)
+                     CartItem, Address, Order, OrderItem, Payment, OrderEvent)
 
 # --- league/team/category ---
 class LeagueSerializer(serializers.ModelSerializer):
@@ -17,14 +18,49 @@ class CategorySerializer(serializers.ModelSerializer):
 class ProductVariantSerializer(serializers.ModelSerializer):
     class Meta: model = ProductVariant; fields = ['id','size','stock','sku']
 
+# computed amounts render like the model's DecimalFields: quantized strings, never floats
+_MONEY = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+
+def _money(value):
+    return _MONEY.to_representation(value)
+
+def _price_of(serializer, obj):
+    # pages pass context['prices'] evaluated for all rows at once; single objects price themselves
+    prices = serializer.context.get('prices')
+    if prices is None or obj.pk not in prices:
+        prices = promotions.evaluate([obj], code=serializer.context.get('coupon'))
+    return prices[obj.pk]
+
 class ProductSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     team = TeamSerializer(read_only=True)
     variants = ProductVariantSerializer(many=True, read_only=True)
     image_url = serializers.SerializerMethodField()
+    effective_price = serializers.SerializerMethodField()
+    promotion = serializers.SerializerMethodField()
+    class Meta:
+        model = Product
+        fields = ['id','title','slug','description','price','effective_price','promotion',
+                  'image_url','category','team','variants']
+    def get_effective_price(self, obj):
+        return _money(_price_of(self, obj).price)
+    def get_promotion(self, obj):
+        rule = _price_of(self, obj).promotion
+        return rule.name if rule else None
+    def get_image_url(self, obj):
+        req = self.context.get('request')
+        return req.build_absolute_uri(obj.image.url) if obj.image and req else (obj.image.url if obj.image else None)
+
+class RelatedProductSerializer(serializers.ModelSerializer):
+    """Slim card for related-product rails (no variants, so it needs no extra query)."""
+    team = serializers.CharField(source='team.name', default=None, read_only=True)
+    image_url = serializers.SerializerMethodField()
+    effective_price = serializers.SerializerMethodField()
     class Meta:
         model = Product
-        fields = ['id','title','slug','description','price','image_url','category','team','variants']
+        fields = ['id','title','slug','price','effective_price','image_url','team']
+    def get_effective_price(self, obj):
+        return _money(_price_of(self, obj).price)
     def get_image_url(self, obj):
         req = self.context.get('request')
         return req.build_absolute_uri(obj.image.url) if obj.image and req else (obj.image.url if obj.image else None)
@@ -35,21 +71,32 @@ class CartItemSerializer(serializers.ModelSerializer):
     product_title = serializers.CharField(source='variant.product.title', read_only=True)
     product_slug = serializers.CharField(source='variant.product.slug', read_only=True)
     product_price = serializers.DecimalField(source='variant.product.price', max_digits=10, decimal_places=2, read_only=True)
+    unit_price = serializers.SerializerMethodField()
     sub_total = serializers.SerializerMethodField()
     class Meta:
         model = CartItem
-        fields = ['id','variant','variant_detail','quantity','product_title','product_slug','product_price','sub_total']
+        fields = ['id','variant','variant_detail','quantity','product_title','product_slug','product_price',
+                  'unit_price','sub_total']
+    def get_unit_price(self, obj):
+        return _money(_price_of(self, obj.variant.product).price)
     def get_sub_total(self, obj):
-        return obj.quantity * obj.variant.product.price
+        return _money(obj.quantity * _price_of(self, obj.variant.product).price)
 
-class CartSerializer(serializers.ModelSerializer):
-    items = CartItemSerializer(many=True, read_only=True)
-    cart_total = serializers.SerializerMethodField()
-    class Meta:
-        model = Cart
-        fields = ['id','items','cart_total']
-    def get_cart_total(self, obj):
-        return sum(it.quantity * it.variant.product.price for it in obj.items.select_related('variant__product'))
+class CartSerializer(serializers.BaseSerializer):
+    """Read-only: lines are loaded in one query and priced in one promotion pass (context['coupon'] optional)."""
+    def to_representation(self, obj):
+        code = self.context.get('coupon')
+        items = list(obj.items.select_related('variant__product'))
+        q = promotions.quote(items, code=code)
+        ctx = {**self.context, 'prices': {it.variant.product.pk: p for it, p in q.lines}}
+        return {
+            'id': obj.id,
+            'items': CartItemSerializer(items, many=True, context=ctx).data,
+            'subtotal': _money(q.subtotal),
+            'discount': _money(q.discount),
+            'cart_total': _money(q.total),
+            'coupon': {'code': promotions.normalize_code(code), 'valid': q.coupon_valid} if code else None,
+        }
 
 # --- address ---
 class AddressSerializer(serializers.ModelSerializer):
@@ -70,5 +117,8 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ['id','user','address','total','status','created_at','items']
         read_only_fields = ['user','status','created_at']
 
+class OrderEventSerializer(serializers.ModelSerializer):
+    class Meta: model = OrderEvent; fields = ['id','event','data','created_at']
+
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta: model = Payment; fields = '__all__'
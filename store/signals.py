@@ -0,0 +1,6 @@
+# store/signals.py
+from django.dispatch import Signal
+
+# Sent once per bulk catalog/stock write (never per row) so downstream caches can
+# invalidate in one go.  kwargs: variant_ids (list[int]), reason (str)
+catalog_changed = Signal()
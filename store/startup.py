@@ -0,0 +1,68 @@
+# store/startup.py
+"""
+Worker cold-start measurement.
+
+measure_startup() boots a fresh interpreter exactly like a WSGI worker does before
+its first request (django.setup(), WSGI handler, URLconf with every view module) and
+reports the wall time, the loaded modules and, optionally, `python -X importtime`
+data aggregated per module.  Used by `manage.py profile_startup` and the start-up
+budget test.
+"""
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+
+BOOT_SNIPPET = """
+import json, sys, time
+t0 = time.perf_counter()
+import django
+django.setup()
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({'seconds': time.perf_counter() - t0, 'modules': sorted(sys.modules)}))
+"""
+
+# modules our code only imports on first use (the gateway client is lazy too, but
+# rest_framework.compat imports `requests` itself whenever it is installed)
+LAZY_MODULES = ('PIL',)
+
+
+def measure_startup(importtime=False):
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'core.settings')}
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ['-X', 'importtime']
+    cmd += ['-c', BOOT_SNIPPET]
+    proc = subprocess.run(cmd, cwd=str(settings.BASE_DIR), env=env, capture_output=True, text=True, check=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    if importtime:
+        result['imports'] = parse_importtime(proc.stderr)
+    return result
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us)] from `-X importtime` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            rows.append((name.strip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return rows
+
+
+def top_level_totals(imports):
+    """Self time summed per top-level package, e.g. all of rest_framework.*."""
+    totals = {}
+    for name, self_us, _ in imports:
+        root = name.split('.', 1)[0]
+        totals[root] = totals.get(root, 0) + self_us
+    return sorted(totals.items(), key=lambda kv: -kv[1])
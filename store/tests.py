@@ -1,3 +1,1194 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import audit
+
+from .models import (League, Team, Category, Product, ProductVariant, Cart, CartItem,
+                     Address, Order, OrderItem, Payment, PaymentQRCode, DailySalesRollup, ProductRelation, OrderEvent,
+                     Promotion, ExchangeRate, SalesRollupLedger)
+
+# Keep throttle buckets in memory (the default store is a shared file) and write audit
+# events at request end rather than from a background thread with its own connection.
+TEST_TOKEN_BUCKET = {'STORE': 'store.throttling.LocalBucketStore'}
+_test_overrides = override_settings(TOKEN_BUCKET=TEST_TOKEN_BUCKET, AUDIT_LOG={'BACKGROUND': False})
+
+
+def setUpModule():
+    _test_overrides.enable()
+
+
+def tearDownModule():
+    _test_overrides.disable()
+
+
+class StoreFixtureMixin:
+    """Small catalog + one customer shared by the API tests."""
+
+    def make_catalog(self):
+        self.league = League.objects.create(name='Premier League', country='England')
+        self.team = Team.objects.create(name='Arsenal', league=self.league)
+        self.category = Category.objects.create(name='Club Jerseys', slug='club-jerseys')
+        self.product = Product.objects.create(
+            title='Arsenal Home', slug='arsenal-home', description='', price=Decimal('2500.00'),
+            image='products/arsenal.jpg', category=self.category, team=self.team)
+        self.v_m = ProductVariant.objects.create(product=self.product, size='M', stock=10, sku='ARS-H-M')
+        self.v_l = ProductVariant.objects.create(product=self.product, size='L', stock=10, sku='ARS-H-L')
+        self.user = User.objects.create_user(username='fan', password='pw12345!')
+        self.address = Address.objects.create(user=self.user, street='Main', city='Kathmandu',
+                                              state='Bagmati', zip_code='44600')
+
+    def make_order(self, lines, provider='KHALTI', status='PENDING'):
+        total = sum(Decimal(v.product.price) * q for v, q in lines)
+        order = Order.objects.create(user=self.user, address=self.address, total=total, status=status)
+        for v, q in lines:
+            OrderItem.objects.create(order=order, variant=v, price=v.product.price, quantity=q)
+        Payment.objects.create(order=order, provider=provider, amount=total)
+        return order
+
+
+# ==================== ANALYTICS ====================
+
+class SalesRollupTests(StoreFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_catalog()
+        self.client = APIClient()
+
+    def test_mark_paid_rolls_up_once(self):
+        order = self.make_order([(self.v_m, 2), (self.v_l, 1)])
+        self.client.force_authenticate(self.user)
+        url = f'/api/orders/{order.id}/mark-paid/'
+        self.assertEqual(self.client.post(url).status_code, 200)
+        self.assertEqual(self.client.post(url).status_code, 200)  # retried: must not double count
+
+        rows = DailySalesRollup.objects.order_by('size')
+        self.assertEqual([(r.size, r.units, r.revenue) for r in rows],
+                         [('L', 1, Decimal('2500.00')), ('M', 2, Decimal('5000.00'))])
+        self.assertEqual({r.provider for r in rows}, {'KHALTI'})
+        self.assertEqual({r.league_id for r in rows}, {self.league.id})
+
+    def test_teamless_products_share_one_rollup_row(self):
+        from django.db import IntegrityError, transaction
+        from .analytics import record_paid_order
+        scarf = Product.objects.create(title='Scarf', slug='scarf', description='', price=Decimal('800.00'),
+                                       image='products/scarf.jpg', category=self.category)
+        v = ProductVariant.objects.create(product=scarf, size='M', stock=10, sku='SCARF-M')
+        for _ in range(2):
+            record_paid_order(self.make_order([(v, 1)], status='PAID'))
+        row = DailySalesRollup.objects.get(product=scarf)
+        self.assertEqual((row.units, row.team_key, row.league_key, row.team_id), (2, 0, 0, None))
+        # the key is NULL-free, so a racing duplicate insert is rejected rather than stored
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailySalesRollup.objects.create(date=row.date, product=scarf, size='M', category=self.category,
+                                            provider=row.provider, units=1, revenue=1, orders=1)
+
+    def test_rebuild_matches_raw_orders(self):
+        self.make_order([(self.v_m, 3)], status='PAID')
+        self.make_order([(self.v_m, 1)], provider='esewa', status='DELIVERED')
+        self.make_order([(self.v_m, 5)], status='PENDING')  # never paid: excluded
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+
+        by_provider = {r.provider: r.units for r in DailySalesRollup.objects.all()}
+        self.assertEqual(by_provider, {'KHALTI': 3, 'ESEWA': 1})
+
+    def test_api_is_staff_only_and_groups(self):
+        self.make_order([(self.v_m, 2)], status='PAID')
+        self.make_order([(self.v_l, 1)], provider='COD', status='PAID')
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/analytics/sales/').status_code, 403)
+
+        staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        self.client.force_authenticate(staff)
+        res = self.client.get('/api/analytics/sales/', {'group_by': 'team,provider'})
+        self.assertEqual(res.status_code, 200)
+        got = {(r['team__name'], r['provider']): (r['units'], r['revenue']) for r in res.json()['results']}
+        self.assertEqual(got, {('Arsenal', 'KHALTI'): (2, '5000.00'), ('Arsenal', 'COD'): (1, '2500.00')})
+
+        res = self.client.get('/api/analytics/sales/', {'group_by': 'bogus'})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(self.client.get('/api/analytics/sales/', {'team': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/analytics/sales/', {'league': 'abc'}).status_code, 400)
+        res = self.client.get('/api/analytics/sales/', {'team': str(self.team.id), 'group_by': ''})
+        self.assertEqual(res.json()['results'], [{'units': 3, 'revenue': '7500.00'}])
+
+
+# ==================== ADMIN ====================
+
+class AdminPerformanceTests(StoreFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_catalog()
+        self.staff = User.objects.create_superuser(username='admin', password='x', email='a@example.com')
+        self.client.force_login(self.staff)
+
+    def test_changelists_do_not_query_per_row(self):
+        for _ in range(5):
+            self.make_order([(self.v_m, 1)])
+        with self.assertNumQueries(4):
+            self.client.get('/admin/store/order/')
+        with self.assertNumQueries(4):
+            self.client.get('/admin/store/productvariant/')
+        for _ in range(5):
+            self.make_order([(self.v_l, 1)])
+        with self.assertNumQueries(4):
+            self.client.get('/admin/store/order/')
+
+    def test_changelist_counts_are_exact_without_an_estimate(self):
+        from .admin import EstimatedCountPaginator
+        carts = [Cart.objects.create(session_id=f's{i}') for i in range(5)]
+        Cart.objects.filter(pk__in=[c.pk for c in carts[:4]]).delete()   # checked out
+        self.assertEqual(EstimatedCountPaginator(Cart.objects.all(), 50).count, 1)
+
+    def test_bulk_actions(self):
+        # an order without a payment first, so Order and Payment pks don't line up
+        Order.objects.create(user=self.user, address=self.address, total=Decimal('0'))
+        orders = [self.make_order([(self.v_m, 1)]) for _ in range(3)]
+        cancelled = self.make_order([(self.v_m, 1)], status='CANCELLED')
+        ids = [str(o.id) for o in orders]
+        payment_ids = [str(pk) for pk in Payment.objects.filter(order__in=orders + [cancelled])
+                       .values_list('pk', flat=True)]
+        self.assertNotEqual(sorted(ids), sorted(payment_ids))
+        res = self.client.post('/admin/store/payment/', {'action': 'verify_payments', '_selected_action': payment_ids},
+                               follow=True)
+        self.assertEqual(Order.objects.filter(status='PAID').count(), 3)
+        self.assertEqual(Payment.objects.filter(is_verified=True).count(), 3)
+        self.assertFalse(Payment.objects.get(order=cancelled).is_verified)
+        self.assertEqual([str(m) for m in res.context['messages']],
+                         ['3 payment(s) verified, their orders are now PAID.',
+                          '1 payment(s) left unverified: their order is not PENDING.'])
+        self.assertEqual(DailySalesRollup.objects.get().units, 3)
+
+        self.client.post('/admin/store/order/', {'action': 'mark_shipped', '_selected_action': ids[:2]})
+        self.assertEqual(Order.objects.filter(status='SHIPPED').count(), 2)
+
+
+# ==================== CATALOG IMPORT / EXPORT ====================
+
+class CatalogImportExportTests(StoreFixtureMixin, TestCase):
+    CSV = (
+        "slug,title,description,price,image,category,team,league,is_active,size,stock,sku\n"
+        "ars-away,Arsenal Away,,2600,products/a.jpg,club-jerseys,Arsenal,Premier League,true,M,5,ARS-A-M\n"
+        "ars-away,Arsenal Away,,2600,products/a.jpg,club-jerseys,Arsenal,Premier League,true,XL,2,ARS-A-XL\n"
+        "bad-cat,Bad,,100,,no-such-category,,,true,M,1,BAD-M\n"
+        "ars-third,Arsenal Third,,abc,,club-jerseys,,,true,M,1,ARS-T-M\n"
+        "ars-gk,Arsenal GK,,2000,,club-jerseys,,,true,XXL,1,ARS-GK-XXL\n"
+        "ars-gk2,Arsenal GK 2,,2000,,club-jerseys,,,true,S,1,ARS-H-M\n"
+    )
+
+    def setUp(self):
+        self.make_catalog()
+
+    def _import(self, text, fmt, **kw):
+        from .catalog_io import import_catalog
+        return import_catalog(StringIO(text), fmt, chunk_size=2, **kw)
+
+    def test_csv_import_reports_row_errors_without_aborting(self):
+        report = self._import(self.CSV, 'csv')
+        self.assertEqual(report.products, 3)  # ars-away, ars-gk, ars-gk2
+        self.assertEqual(report.variants, 2)
+        self.assertEqual([line for line, _ in report.errors], [4, 5, 6, 7])
+
+        away = Product.objects.get(slug='ars-away')
+        self.assertEqual(away.team, self.team)
+        self.assertEqual(sorted(away.variants.values_list('sku', flat=True)), ['ARS-A-M', 'ARS-A-XL'])
+        # an existing sku of another product is never stolen
+        self.assertEqual(ProductVariant.objects.get(sku='ARS-H-M').product, self.product)
+
+    def test_reimport_upserts_and_dry_run_writes_nothing(self):
+        self._import(self.CSV, 'csv')
+        self._import(self.CSV.replace('2600,products/a.jpg', '2700,products/a.jpg')
+                             .replace('M,5,ARS-A-M', 'M,9,ARS-A-M'), 'csv')
+        away = Product.objects.get(slug='ars-away')
+        self.assertEqual(away.price, Decimal('2700'))
+        self.assertEqual(ProductVariant.objects.get(sku='ARS-A-M').stock, 9)
+
+        before = Product.objects.count()
+        report = self._import('{"slug": "new", "title": "New", "price": "1", "category": "club-jerseys"}\n',
+                              'jsonl', dry_run=True)
+        self.assertEqual((report.products, report.errors), (1, []))
+        self.assertEqual(Product.objects.count(), before)
+
+    def test_jsonl_export_round_trips(self):
+        from .catalog_io import export_catalog
+        out = StringIO()
+        self.assertEqual(export_catalog(out, 'jsonl'), 1)
+        Product.objects.all().delete()
+
+        report = self._import(out.getvalue(), 'jsonl')
+        self.assertEqual((report.products, report.variants, report.errors), (1, 2, []))
+        p = Product.objects.get(slug='arsenal-home')
+        self.assertEqual((p.team, p.image.name), (self.team, 'products/arsenal.jpg'))
+
+
+# ==================== INVENTORY ====================
+
+class StockAdjustTests(StoreFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_catalog()
+        self.client = APIClient()
+        self.staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+
+    def test_batch_sets_and_deltas_with_per_sku_results(self):
+        from .signals import catalog_changed
+        calls = []
+        handler = lambda **kw: calls.append(sorted(kw['variant_ids']))
+        catalog_changed.connect(handler)
+        self.addCleanup(catalog_changed.disconnect, handler)
+
+        self.client.force_authenticate(self.staff)
+        res = self.client.post('/api/inventory/stock/', {'entries': [
+            {'sku': 'ARS-H-M', 'stock': 40},
+            {'sku': 'ARS-H-L', 'delta': -3},
+            {'sku': 'NOPE', 'delta': 1},
+            {'sku': 'ARS-H-L', 'delta': -50},
+            {'sku': 'ARS-H-M', 'stock': 1, 'delta': 1},
+        ]}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['updated'], 2)
+        self.assertEqual([r['status'] for r in res.data['results']],
+                         ['updated', 'updated', 'not_found', 'invalid', 'invalid'])
+        self.v_m.refresh_from_db(); self.v_l.refresh_from_db()
+        self.assertEqual((self.v_m.stock, self.v_l.stock), (40, 7))
+        self.assertEqual(calls, [sorted([self.v_m.id, self.v_l.id])])  # once per batch
+
+    def test_fractional_amounts_are_invalid_not_truncated(self):
+        from .inventory import apply_stock_batch
+        out = apply_stock_batch([{'sku': 'ARS-H-M', 'delta': 1.9}, {'sku': 'ARS-H-L', 'stock': 5.0}])
+        self.assertEqual([r['status'] for r in out['results']], ['invalid', 'updated'])
+        self.v_m.refresh_from_db(); self.v_l.refresh_from_db()
+        self.assertEqual((self.v_m.stock, self.v_l.stock), (10, 5))
+
+    def test_negative_delta_is_refused_not_clamped(self):
+        from .inventory import apply_stock_batch
+        out = apply_stock_batch([{'sku': 'ARS-H-M', 'delta': -11}], chunk_size=1)
+        self.assertEqual(out['results'][0]['status'], 'insufficient')
+        self.v_m.refresh_from_db()
+        self.assertEqual(self.v_m.stock, 10)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(self.user)
+        res = self.client.post('/api/inventory/stock/', [{'sku': 'ARS-H-M', 'stock': 1}], format='json')
+        self.assertEqual(res.status_code, 403)
+
+
+# ==================== RECOMMENDATIONS ====================
+
+class RelatedProductsTests(StoreFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_catalog()
+        self.chelsea = Team.objects.create(name='Chelsea', league=self.league)
+
+        def product(slug, team):
+            p = Product.objects.create(title=slug, slug=slug, description='', price=Decimal('1000'),
+                                       image='products/x.jpg', category=self.category, team=team)
+            return p, ProductVariant.objects.create(product=p, size='M', stock=50, sku=f'{slug}-M')
+
+        self.away, self.v_away = product('arsenal-away', self.team)
+        self.scarf, self.v_scarf = product('arsenal-scarf', self.team)
+        self.blues, self.v_blues = product('chelsea-home', self.chelsea)
+
+    def test_copurchase_ranked_then_team_then_league_fallback(self):
+        from .promotions import get_engine
+        from .recommendations import build_relations
+        for _ in range(2):
+            self.make_order([(self.v_m, 1), (self.v_blues, 1)], status='PAID')
+        self.make_order([(self.v_m, 1), (self.v_scarf, 1)], status='PAID')
+        self.make_order([(self.v_m, 1), (self.v_away, 1)], status='PENDING')  # unpaid: ignored
+        build_relations(top_k=3)
+
+        get_engine()  # compiled promotion rules are per-process, not per request
+        with self.assertNumQueries(1):
+            res = self.client.get('/api/products/arsenal-home/related/')
+        self.assertEqual([p['slug'] for p in res.json()], ['chelsea-home', 'arsenal-scarf', 'arsenal-away'])
+        self.assertEqual(list(ProductRelation.objects.filter(product=self.product).values_list('source', flat=True)),
+                         ['COPURCHASE', 'COPURCHASE', 'TEAM'])
+
+        # cold-start product with no orders still gets same-team neighbours first
+        res = self.client.get('/api/products/arsenal-away/related/')
+        self.assertEqual([p['slug'] for p in res.json()][:2], ['arsenal-scarf', 'arsenal-home'])
+
+    def test_unknown_slug_is_404(self):
+        self.assertEqual(self.client.get('/api/products/no-such-kit/related/').status_code, 404)
+        ProductRelation.objects.all().delete()
+        res = self.client.get('/api/products/arsenal-home/related/')
+        self.assertEqual((res.status_code, res.json()), (200, []))
+
+
+# ==================== IDEMPOTENCY ====================
+
+class IdempotencyTests(StoreFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_catalog()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, variant=self.v_m, quantity=2)
+
+    def checkout(self, key, address=None):
+        return self.client.post('/api/orders/', {'address': address or self.address.id},
+                                format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_without_second_checkout(self):
+        first = self.checkout('k1')
+        self.assertEqual(first.status_code, 201)
+        retry = self.checkout('k1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+        self.assertEqual(Order.objects.count(), 1)
+        self.v_m.refresh_from_db()
+        self.assertEqual(self.v_m.stock, 8)
+
+    def test_key_reuse_with_other_body_is_rejected(self):
+        self.checkout('k2')
+        self.assertEqual(self.checkout('k2', address=999).status_code, 422)
+
+    def test_stale_in_progress_claim_is_taken_over(self):
+        from .idempotency import fingerprint
+        from .models import IdempotencyRecord
+        req = mock.Mock(method='POST', path='/api/orders/', data={'address': self.address.id})
+        rec = IdempotencyRecord.objects.create(user=self.user, scope='checkout', key='k3', fingerprint=fingerprint(req),
+                                               expires_at=timezone.now() + timedelta(hours=24))
+        with override_settings(IDEMPOTENCY_WAIT_SECONDS=0):
+            self.assertEqual(self.checkout('k3').status_code, 409)  # holder may still be running
+        # the worker that claimed it died: once the lease runs out the retry goes through
+        IdempotencyRecord.objects.filter(pk=rec.pk).update(created_at=timezone.now() - timedelta(minutes=5))
+        res = self.checkout('k3')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(IdempotencyRecord.objects.get(key='k3').state, 'DONE')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_gateway_outage_is_not_replayed(self):
+        order = Order.objects.create(user=self.user, address=self.address, total=Decimal('2500'))
+        url = f'/api/payments/khalti/initiate/{order.id}/'
+        with mock.patch('requests.post') as post:
+            post.return_value = mock.Mock(status_code=503, json=lambda: {'detail': 'maintenance'})
+            self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY='pay-1').status_code, 502)
+            post.return_value = mock.Mock(status_code=200, json=lambda: {'pidx': 'P1', 'payment_url': 'https://pay/1'})
+            res = self.client.post(url, HTTP_IDEMPOTENCY_KEY='pay-1')
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', res)
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(res.json()['pidx'], 'P1')
+
+    def test_no_header_is_not_deduplicated(self):
+        self.assertEqual(self.client.post('/api/orders/', {'address': self.address.id}).status_code, 201)
+        self.assertEqual(self.client.post('/api/orders/', {'address': self.address.id}).status_code, 400)  # cart empty
+
+
+class ConcurrentIdempotencyTests(StoreFixtureMixin, TransactionTestCase):
+    """Duplicate arrives while the original gateway round-trip is still in flight."""
+
+    def setUp(self):
+        self.make_catalog()
+        self.order = self.make_order([(self.v_m, 1)])
+
+    def _post(self, results, key):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        try:
+            results.append(client.post(f'/api/payments/khalti/initiate/{self.order.id}/',
+                                       HTTP_IDEMPOTENCY_KEY=key))
+        finally:
+            connection.close()
+
+    def test_concurrent_duplicate_waits_and_replays(self):
+        release, entered = threading.Event(), threading.Event()
+
+        def slow_gateway(*args, **kwargs):
+            entered.set()
+            release.wait(5)
+            return mock.Mock(status_code=200, json=lambda: {'pidx': 'PIDX1', 'payment_url': 'https://pay/1'})
+
+        results = []
+        with mock.patch('requests.post', side_effect=slow_gateway) as gateway:
+            first = threading.Thread(target=self._post, args=(results, 'retry-1'))
+            first.start()
+            self.assertTrue(entered.wait(5))
+            dup = threading.Thread(target=self._post, args=(results, 'retry-1'))
+            dup.start()
+            dup.join(0.3)
+            self.assertTrue(dup.is_alive())  # blocked behind the in-flight original
+            release.set()
+            first.join(5); dup.join(5)
+
+        self.assertEqual(gateway.call_count, 1)
+        self.assertEqual([r.status_code for r in results], [200, 200])
+        self.assertEqual({r.json()['pidx'] for r in results}, {'PIDX1'})
+        self.assertEqual(sum(1 for r in results if r.has_header('Idempotent-Replayed')), 1)
+
+    def test_failed_original_releases_key(self):
+        with mock.patch('requests.post', side_effect=ConnectionError('down')):
+            with self.assertRaises(ConnectionError):
+                self._post([], 'retry-2')
+        ok = mock.Mock(status_code=200, json=lambda: {'pidx': 'PIDX2', 'payment_url': 'https://pay/2'})
+        with mock.patch('requests.post', return_value=ok) as gateway:
+            results = []
+            self._post(results, 'retry-2')
+        self.assertEqual((gateway.call_count, results[0].status_code), (1, 200))
+
+
+# ==================== PAYMENT OPTIONS ====================
+
+class PaymentOptionsTests(TestCase):
+    def setUp(self):
+        from . import payment_config
+        payment_config.invalidate()
+        self.addCleanup(payment_config.invalidate)
+        self.qr = PaymentQRCode.objects.create(payment_type='ESEWA', qr_code='qr_codes/esewa.png',
+                                               account_name='Jersey Empire', account_number='98000')
+
+    def test_served_from_cache_with_http_caching(self):
+        res = self.client.get('/api/payments/options/')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('max-age=3600', res['Cache-Control'])
+        esewa = next(m for m in res.json()['methods'] if m['code'] == 'ESEWA')
+        self.assertEqual(esewa['qr']['qr_code'], 'http://testserver/media/qr_codes/esewa.png')
+
+        with self.assertNumQueries(0):
+            again = self.client.get('/api/payments/options/')
+            not_modified = self.client.get('/api/payments/options/', HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(again.json(), res.json())
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_save_and_delete_invalidate(self):
+        self.client.get('/api/payments/options/')
+        self.qr.account_number = '98111'
+        self.qr.save()
+        esewa = next(m for m in self.client.get('/api/payments/options/').json()['methods'] if m['code'] == 'ESEWA')
+        self.assertEqual(esewa['qr']['account_number'], '98111')
+
+        self.qr.delete()
+        esewa = next(m for m in self.client.get('/api/payments/options/').json()['methods'] if m['code'] == 'ESEWA')
+        self.assertIsNone(esewa['qr'])
+
+    @override_settings(PAYMENT_CONFIG={'MAX_BASE_URLS': 2}, ALLOWED_HOSTS=['*'])
+    def test_client_supplied_hosts_do_not_grow_the_cache(self):
+        from . import payment_config
+        for host in ('a.example', 'b.example', 'c.example', 'd.example'):
+            res = self.client.get('/api/payments/options/', HTTP_HOST=host)
+            esewa = next(m for m in res.json()['methods'] if m['code'] == 'ESEWA')
+            self.assertEqual(esewa['qr']['qr_code'], f'http://{host}/media/qr_codes/esewa.png')
+        _, by_base = payment_config._qr_codes()
+        self.assertEqual(sorted(by_base), ['http://a.example', 'http://b.example'])
+
+
+# ==================== THROTTLING ====================
+
+class TokenBucketThrottleTests(StoreFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_catalog()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fill_cart(self):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        CartItem.objects.create(cart=cart, variant=self.v_m, quantity=1)
+
+    @override_settings(TOKEN_BUCKET={**TEST_TOKEN_BUCKET, 'USER': {'capacity': 25, 'rate': 0.001},
+                                     'COSTS': {'OrderViewSet.create': 20}})
+    def test_expensive_endpoints_spend_more_tokens(self):
+        self.fill_cart()
+        self.assertEqual(self.client.post('/api/orders/', {'address': self.address.id}).status_code, 201)
+        self.fill_cart()
+        blocked = self.client.post('/api/orders/', {'address': self.address.id})
+        self.assertEqual(blocked.status_code, 429)
+        self.assertIn('Retry-After', blocked)
+        for _ in range(5):  # the 5 tokens left still serve cheap reads
+            self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+        self.assertEqual(self.client.get('/api/cart/').status_code, 429)
+
+    @override_settings(TOKEN_BUCKET={**TEST_TOKEN_BUCKET, 'GLOBAL': {'checkout': {
+        'capacity': 1, 'rate': 0.001, 'max_wait': 0, 'max_queue': 0, 'endpoints': ['OrderViewSet.create']}}})
+    def test_global_checkout_bucket_sheds_across_users(self):
+        self.fill_cart()
+        self.assertEqual(self.client.post('/api/orders/', {'address': self.address.id}).status_code, 201)
+
+        other = User.objects.create_user(username='other', password='x')
+        addr = Address.objects.create(user=other, street='s', city='c', state='s', zip_code='1')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.post('/api/orders/', {'address': addr.id}).status_code, 429)
+        self.assertEqual(Order.objects.count(), 1)
+
+    @override_settings(TOKEN_BUCKET={**TEST_TOKEN_BUCKET, 'USER': {'capacity': 20, 'rate': 0.001},
+                                     'COSTS': {'OrderViewSet.create': 20},
+                                     'GLOBAL': {'checkout': {'capacity': 1, 'rate': 0.001, 'max_wait': 0,
+                                                             'max_queue': 0, 'endpoints': ['OrderViewSet.create']}}})
+    def test_shed_requests_are_not_billed_to_the_client(self):
+        from .throttling import get_store
+        get_store().consume('global:checkout', 1, 1, 0.001)  # someone else took the only slot
+        self.fill_cart()
+        self.assertEqual(self.client.post('/api/orders/', {'address': self.address.id}).status_code, 429)
+        # the 20 tokens were refunded: the whole user bucket is still there for cheap calls
+        for _ in range(20):
+            self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+
+    def test_sqlite_store_refund(self):
+        from .throttling import SQLiteBucketStore
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SQLiteBucketStore(os.path.join(tmp, 'buckets.sqlite3'))
+            store.consume('user:1', 4, capacity=5, rate=0.001, now=100.0)
+            store.refund('user:1', 4, capacity=5)
+            self.assertEqual(store.consume('user:1', 5, capacity=5, rate=0.001, now=100.0), (True, 0.0))
+            store.refund('user:1', 50, capacity=5)  # never above capacity
+            self.assertFalse(store.consume('user:1', 6, capacity=5, rate=0.001, now=100.0)[0])
+
+    def test_local_store_is_bounded(self):
+        from .throttling import LocalBucketStore
+        store = LocalBucketStore(max_entries=2)
+        for key in ('ip:1', 'ip:2', 'ip:1', 'ip:3'):
+            store.consume(key, 1, capacity=5, rate=0.001, now=100.0)
+        self.assertEqual(list(store._buckets), ['ip:1', 'ip:3'])   # least recently used went first
+
+    def test_sqlite_store_prunes_idle_buckets_as_it_goes(self):
+        from .throttling import SQLiteBucketStore
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SQLiteBucketStore(os.path.join(tmp, 'buckets.sqlite3'), prune_every=2)
+            store.consume('ip:idle', 1, capacity=5, rate=1, now=0.0)
+            store.consume('ip:busy', 1, capacity=5, rate=1)
+            keys = [k for k, in store._conn().execute('SELECT key FROM buckets')]
+            self.assertEqual(keys, ['ip:busy'])
+
+    def test_sqlite_store_is_shared_between_workers(self):
+        from .throttling import SQLiteBucketStore
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'buckets.sqlite3')
+            worker_a, worker_b = SQLiteBucketStore(path), SQLiteBucketStore(path)
+            self.assertEqual(worker_a.consume('user:1', 3, capacity=5, rate=1, now=100.0), (True, 0.0))
+            allowed, retry = worker_b.consume('user:1', 3, capacity=5, rate=1, now=100.0)
+            self.assertFalse(allowed)
+            self.assertAlmostEqual(retry, 1.0)
+            self.assertTrue(worker_b.consume('user:1', 3, capacity=5, rate=1, now=101.0)[0])
+
+
+# ==================== AUTHENTICATION ====================
+
+class CachedJWTAuthenticationTests(StoreFixtureMixin, TestCase):
+    def setUp(self):
+        from .authentication import token_user_cache
+        from rest_framework_simplejwt.tokens import AccessToken
+        token_user_cache.clear()
+        self.addCleanup(token_user_cache.clear)
+        self.make_catalog()
+        Cart.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_second_request_skips_user_query(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+        with CaptureQueriesContext(connection) as second:
+            self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+        user_queries = lambda ctx: [q for q in ctx.captured_queries if 'FROM "auth_user"' in q['sql']]
+        self.assertEqual(len(user_queries(first)), 1)
+        self.assertEqual(user_queries(second), [])
+
+    def test_deactivation_and_password_change_invalidate(self):
+        self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/cart/').status_code, 401)
+
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+        from .authentication import token_user_cache
+        self.assertEqual(len(token_user_cache), 1)
+        self.user.set_password('n3w-secret!')
+        self.user.save()
+        self.assertEqual(len(token_user_cache), 0)
+
+    def test_staff_flag_is_served_from_cache(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+        staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        order = self.make_order([(self.v_m, 1)])
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(staff)}')
+        self.client.get('/api/cart/')  # warm
+        res = self.client.post(f'/api/orders/{order.id}/verify-payment/')
+        self.assertEqual(res.status_code, 200)
+
+    def test_login_merges_guest_cart(self):
+        guest = Cart.objects.create(session_id='guest-1')
+        CartItem.objects.create(cart=guest, variant=self.v_l, quantity=2)
+        res = APIClient().post('/api/auth/token/', {'username': 'fan', 'password': 'pw12345!'},
+                               HTTP_X_SESSION_ID='guest-1')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('access', res.json())
+        self.assertEqual(list(CartItem.objects.filter(cart__user=self.user).values_list('quantity', flat=True)), [2])
+        self.assertEqual(APIClient().post('/api/auth/token/', {'username': 'fan', 'password': 'bad'}).status_code, 401)
+
+
+# ==================== AUDIT LOG ====================
+
+class OrderEventTests(StoreFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_catalog()
+        self.client = APIClient()
+        self.addCleanup(audit.flush)
+
+    def test_gateway_history_is_kept_and_queryable(self):
+        order = self.make_order([(self.v_m, 1)], provider='khalti')
+        Payment.objects.filter(order=order).update(pidx='P1')
+        lookups = [{'status': 'Pending', 'total_amount': 250000}, {'status': 'Completed', 'total_amount': 250000}]
+        for body in lookups:
+            with mock.patch('requests.post', return_value=mock.Mock(status_code=200, json=lambda b=body: b)), \
+                    self.captureOnCommitCallbacks(execute=True):
+                self.client.get('/api/payments/khalti/callback/', {'pidx': 'P1'})
+            audit.flush()
+
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(2):  # order ownership + events
+            res = self.client.get(f'/api/orders/{order.id}/events/')
+        events = [(e['event'], e['data'].get('response', {}).get('status'), e['data'].get('to')) for e in res.json()]
+        self.assertEqual(events, [('gateway.khalti.lookup', 'Pending', None),
+                                  ('gateway.khalti.lookup', 'Completed', None),
+                                  ('order.status', None, 'PAID')])
+        self.assertEqual(Payment.objects.get(order=order).meta['status'], 'Completed')  # meta still holds the latest
+
+        other = User.objects.create_user(username='other', password='x')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(f'/api/orders/{order.id}/events/').status_code, 404)
+
+    def test_record_is_buffered_until_flush(self):
+        order = self.make_order([(self.v_m, 1)])
+        with self.assertNumQueries(0), self.captureOnCommitCallbacks(execute=True):
+            for i in range(10):
+                audit.record(order.id, 'order.note', n=i)
+        with self.assertNumQueries(3):  # savepoint + bulk INSERT + release
+            self.assertEqual(audit.flush(), 10)
+
+    def test_rolled_back_work_is_not_logged(self):
+        from django.db import transaction
+        order = self.make_order([(self.v_m, 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                audit.record(order.id, 'order.created', total=1)
+                raise RuntimeError('checkout failed')
+        self.assertEqual((audit.pending(), audit.flush()), (0, 0))
+
+    def test_esewa_failure_is_logged(self):
+        order = self.make_order([(self.v_m, 1)], provider='esewa')
+        Payment.objects.filter(order=order).update(transaction_uuid='abc')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get('/api/payments/esewa/failure/', {'transaction_uuid': 'abc'})
+        audit.flush()
+        ev = OrderEvent.objects.get()
+        self.assertEqual((ev.order_id, ev.event, ev.data['params']), (order.id, 'gateway.esewa.failure', {'transaction_uuid': 'abc'}))
+
+    def test_compaction_archives_to_gzip_jsonl(self):
+        order = self.make_order([(self.v_m, 1)])
+        old = timezone.now() - timedelta(days=400)
+        OrderEvent.objects.create(order=order, event='order.status', data={'to': 'PAID'}, created_at=old)
+        OrderEvent.objects.create(order=order, event='order.status', data={'to': 'SHIPPED'}, created_at=timezone.now())
+        with tempfile.TemporaryDirectory() as tmp:
+            call_command('compact_order_events', days=180, archive_dir=tmp, stdout=StringIO())
+            with gzip.open(os.path.join(tmp, f'order-events-{old:%Y-%m}.jsonl.gz'), 'rt') as fh:
+                rows = [json.loads(line) for line in fh]
+        self.assertEqual([(r['o'], r['d']) for r in rows], [(order.id, {'to': 'PAID'})])
+        self.assertEqual(list(OrderEvent.objects.values_list('data__to', flat=True)), ['SHIPPED'])
+
+
+class AuditFlushFailureTests(StoreFixtureMixin, TransactionTestCase):
+    """Real commits, so a dangling order FK fails the INSERT like it does in production."""
+
+    def setUp(self):
+        self.make_catalog()
+        self.addCleanup(audit.flush)
+
+    def test_one_bad_event_does_not_sink_the_batch(self):
+        a, b = self.make_order([(self.v_m, 1)]), self.make_order([(self.v_l, 1)])
+        audit.record(a.id, 'order.note', n=1)
+        audit.record(999999, 'order.note', n=2)  # order gone (deleted / rolled-back checkout)
+        audit.record(b.id, 'order.note', n=3)
+        with self.assertLogs('store.audit', 'WARNING') as logs:
+            self.assertEqual(audit.flush(), 2)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(sorted(OrderEvent.objects.values_list('data__n', flat=True)), [1, 3])
+        self.assertEqual(audit.pending(), 0)
+
+    def test_lost_connection_keeps_the_batch(self):
+        from django.db import InterfaceError
+        order = self.make_order([(self.v_m, 1)])
+        audit.record(order.id, 'order.note', n=1)
+        audit.record(order.id, 'order.note', n=2)
+        with mock.patch.object(OrderEvent.objects, 'bulk_create', side_effect=InterfaceError('connection already closed')), \
+                self.assertLogs('store.audit', 'ERROR'):
+            self.assertEqual(audit.flush(), 0)
+        self.assertEqual(audit.pending(), 2)
+        self.assertEqual(audit.flush(), 2)
+        self.assertEqual(sorted(OrderEvent.objects.values_list('data__n', flat=True)), [1, 2])
+
+    def test_flusher_reconnects_and_survives_errors(self):
+        class Stop(BaseException):
+            pass
+        with mock.patch.object(audit, 'close_old_connections') as close, \
+                mock.patch.object(audit, 'flush', side_effect=[RuntimeError('boom'), Stop()]), \
+                self.assertLogs('store.audit', 'ERROR'):
+            with self.assertRaises(Stop):
+                audit._run(0)
+        self.assertEqual(close.call_count, 2)   # once per loop, before flushing
+
+
+# ==================== ORDER STATE MACHINE ====================
+
+class OrderStateMachineTests(StoreFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_catalog()
+        self.addCleanup(audit.flush)
+        self.client = APIClient()
+        self.staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+
+    def test_single_transitions_are_validated(self):
+        from .order_states import InvalidTransition, transition
+        order = self.make_order([(self.v_m, 1)])
+        self.assertTrue(transition(order, 'PAID'))
+        self.assertFalse(transition(order, 'PAID'))  # already there
+        with self.assertRaises(InvalidTransition):
+            transition(order, 'DELIVERED')
+        stale = Order.objects.get(pk=order.pk)
+        transition(order, 'SHIPPED')
+        with self.assertRaises(InvalidTransition):  # row moved on under the stale copy
+            transition(stale, 'CANCELLED')
+
+    def test_mark_paid_rejects_shipped_order(self):
+        order = self.make_order([(self.v_m, 1)], status='SHIPPED')
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.post(f'/api/orders/{order.id}/mark-paid/').status_code, 400)
+        self.assertFalse(Payment.objects.get(order=order).is_verified)
+
+    def test_bulk_api_reports_per_order_and_restocks_cancellations(self):
+        paid = self.make_order([(self.v_m, 2), (self.v_l, 1)], status='PAID')
+        pending = self.make_order([(self.v_m, 3)])
+        shipped = self.make_order([(self.v_l, 1)], status='SHIPPED')
+        self.client.force_authenticate(self.staff)
+        res = self.client.post('/api/orders/bulk-transition/',
+                               {'ids': [paid.id, pending.id, shipped.id, 99999], 'to': 'CANCELLED'}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['moved'], 2)
+        self.assertEqual({k: v['status'] for k, v in res.data['results'].items()},
+                         {str(paid.id): 'ok', str(pending.id): 'ok', str(shipped.id): 'invalid', '99999': 'not_found'})
+        self.v_m.refresh_from_db(); self.v_l.refresh_from_db()
+        self.assertEqual((self.v_m.stock, self.v_l.stock), (15, 11))
+
+        res = self.client.post('/api/orders/bulk-transition/', {'ids': [shipped.id], 'to': 'DELIVERED', 'from': 'PAID'},
+                               format='json')
+        self.assertEqual(res.data['results'][str(shipped.id)]['status'], 'conflict')
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.post('/api/orders/bulk-transition/', {'ids': [paid.id], 'to': 'PAID'},
+                                          format='json').status_code, 403)
+
+    def test_bulk_paid_rolls_up_per_chunk_not_per_order(self):
+        from .order_states import bulk_transition
+        orders = Order.objects.bulk_create(
+            [Order(user=self.user, address=self.address, total=Decimal('2500')) for _ in range(1000)])
+        OrderItem.objects.bulk_create([OrderItem(order=o, variant=self.v_m, price=Decimal('2500'), quantity=1)
+                                       for o in orders])
+        with CaptureQueriesContext(connection) as queries:
+            results = bulk_transition([o.id for o in orders], 'PAID', expected='PENDING')
+        self.assertTrue(all(r['status'] == 'ok' for r in results.values()))
+        self.assertLessEqual(len(queries), 2 * 15)  # two 500-order chunks, savepoints included
+        row = DailySalesRollup.objects.get()
+        self.assertEqual((row.units, row.orders, row.revenue), (1000, 1000, Decimal('2500000.00')))
+
+    def test_cancelling_paid_orders_reverses_their_rollups(self):
+        from .analytics import rebuild_rollups
+        from .order_states import bulk_transition, transition
+        kept = self.make_order([(self.v_m, 2)])
+        gone = self.make_order([(self.v_m, 1), (self.v_l, 3)])
+        bulk_transition([kept.id, gone.id], 'PAID')
+        self.assertEqual(DailySalesRollup.objects.count(), 2)
+        transition(Order.objects.get(pk=gone.pk), 'CANCELLED')
+        self.assertFalse(SalesRollupLedger.objects.filter(order=gone).exists())
+        incremental = sorted(DailySalesRollup.objects.values_list('size', 'units', 'orders', 'revenue'))
+        self.assertEqual(incremental, [('M', 2, 1, Decimal('5000.00'))])
+        rebuild_rollups()
+        self.assertEqual(sorted(DailySalesRollup.objects.values_list('size', 'units', 'orders', 'revenue')), incremental)
+
+    def test_bulk_throughput_10k_orders(self):
+        from .order_states import bulk_transition
+
+        def make(n, status):
+            orders = Order.objects.bulk_create(
+                [Order(user=self.user, address=self.address, total=Decimal('2500'), status=status) for _ in range(n)])
+            OrderItem.objects.bulk_create(
+                [OrderItem(order=o, variant=self.v_m, price=Decimal('2500'), quantity=1) for o in orders],
+                batch_size=2000)
+            return [o.id for o in orders]
+        paid, pending = make(10000, 'PAID'), make(10000, 'PENDING')
+
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as ship_queries:
+            shipped = bulk_transition(paid, 'SHIPPED', expected='PAID')
+        with CaptureQueriesContext(connection) as deliver_queries:
+            bulk_transition(paid[:5000], 'DELIVERED')
+        with CaptureQueriesContext(connection) as cancel_queries:
+            cancelled = bulk_transition(pending, 'CANCELLED')
+        elapsed = time.perf_counter() - started
+
+        self.assertTrue(all(r['status'] == 'ok' for r in shipped.values()))
+        self.assertTrue(all(r['status'] == 'ok' for r in cancelled.values()))
+        self.assertEqual(Order.objects.filter(status='DELIVERED').count(), 5000)
+        self.v_m.refresh_from_db()
+        self.assertEqual(self.v_m.stock, 10 + 10000)   # every cancelled item back on the shelf
+        # set-based: lock + UPDATE (+ savepoint pair, + restock GROUP BY and CASE UPDATE) per
+        # 500-order chunk, never per order
+        self.assertLessEqual(len(ship_queries), 20 * 4)
+        self.assertLessEqual(len(deliver_queries), 10 * 4)
+        self.assertLessEqual(len(cancel_queries), 20 * 6)
+        self.assertLess(elapsed, 30)
+
+    def test_bulk_chunk_rolls_back_when_rows_move_underneath(self):
+        from django.db.models.query import QuerySet
+        from .order_states import bulk_transition
+        orders = [self.make_order([(self.v_m, 1)]) for _ in range(3)]
+        real_update = QuerySet.update
+
+        def racing_update(qs, **kwargs):
+            real_update(Order.objects.filter(pk=orders[0].pk), status='CANCELLED')  # another worker wins
+            return real_update(qs, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', racing_update):
+            results = bulk_transition([o.id for o in orders], 'PAID')
+        self.assertEqual({r['status'] for r in results.values()}, {'conflict'})
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'PENDING'})
+        self.assertFalse(DailySalesRollup.objects.exists())
+
+
+# ==================== STARTUP ====================
+
+class StartupBudgetTests(TestCase):
+    """Cold start of a fresh worker process (settings, app registry, WSGI handler, URLconf)."""
+
+    BUDGET_SECONDS = float(os.environ.get('STARTUP_BUDGET_SECONDS', 3.0))
+
+    def test_worker_boots_within_budget(self):
+        from .startup import LAZY_MODULES, measure_startup
+        result = min((measure_startup() for _ in range(2)), key=lambda r: r['seconds'])
+        self.assertLess(result['seconds'], self.BUDGET_SECONDS)
+        self.assertEqual([m for m in LAZY_MODULES if m in result['modules']], [])
+
+    def test_gateway_client_is_imported_on_first_use(self):
+        from . import views_payments
+        self.assertFalse(hasattr(views_payments, 'requests'))
+        with mock.patch('requests.get') as get:
+            get.return_value.json.return_value = {}
+            views_payments._http().get('https://example.invalid')
+        get.assert_called_once()
+
+    def test_profile_startup_command(self):
+        out = StringIO()
+        call_command('profile_startup', '--runs', '1', '--top', '5', stdout=out)
+        self.assertIn('Time to ready', out.getvalue())
+        self.assertIn('django', out.getvalue())
+
+
+# ==================== AVAILABILITY ====================
+
+class VariantAvailabilityTests(StoreFixtureMixin, TestCase):
+    def setUp(self):
+        from . import availability
+        self.make_catalog()
+        self.client = APIClient()
+        availability.invalidate()
+        self.addCleanup(availability.invalidate)
+
+    def test_matrix_for_products_and_variants_in_one_call(self):
+        res = self.client.get('/api/variants/availability/',
+                              {'products': 'arsenal-home,nope', 'variants': f'{self.v_l.id},999999'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['products']['arsenal-home'],
+                         {'M': {'variant': self.v_m.id, 'stock': 10}, 'L': {'variant': self.v_l.id, 'stock': 10}})
+        self.assertEqual(res.data['variants'][str(self.v_l.id)], {'product': 'arsenal-home', 'size': 'L', 'stock': 10})
+        self.assertEqual(res.data['missing'], {'products': ['nope'], 'variants': [999999]})
+        self.assertEqual(res['Cache-Control'], 'public, max-age=5')
+
+        res = self.client.post('/api/variants/availability/', {'variants': [self.v_m.id]}, format='json')
+        self.assertEqual(res.data['variants'][str(self.v_m.id)]['stock'], 10)
+        self.assertEqual(self.client.get('/api/variants/availability/').status_code, 400)
+        self.assertEqual(self.client.post('/api/variants/availability/', [self.v_m.id], format='json').status_code, 400)
+        self.assertEqual(self.client.get('/api/variants/availability/', {'variants': 'x'}).status_code, 400)
+
+    def test_answers_from_memory_and_patches_committed_saves(self):
+        self.client.get('/api/variants/availability/', {'products': 'arsenal-home'})
+        with self.assertNumQueries(0):
+            self.client.get('/api/variants/availability/', {'products': 'arsenal-home', 'variants': self.v_m.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.v_m.stock = 3
+            self.v_m.save()
+        with self.assertNumQueries(0):
+            res = self.client.get('/api/variants/availability/', {'variants': self.v_m.id})
+        self.assertEqual(res.data['variants'][str(self.v_m.id)]['stock'], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.create(product=self.product, size='XL', stock=4, sku='ARS-H-XL')
+        res = self.client.get('/api/variants/availability/', {'products': 'arsenal-home'})
+        self.assertEqual(res.data['products']['arsenal-home']['XL']['stock'], 4)
+
+    def test_staleness_is_bounded_by_max_age(self):
+        self.client.get('/api/variants/availability/', {'variants': self.v_m.id})
+        ProductVariant.objects.filter(pk=self.v_m.pk).update(stock=0)  # no signal, like another worker
+        res = self.client.get('/api/variants/availability/', {'variants': self.v_m.id})
+        self.assertEqual(res.data['variants'][str(self.v_m.id)]['stock'], 10)
+        with override_settings(AVAILABILITY_SNAPSHOT={'MAX_AGE': 0}):
+            res = self.client.get('/api/variants/availability/', {'variants': self.v_m.id})
+        self.assertEqual(res.data['variants'][str(self.v_m.id)]['stock'], 0)
+
+    def test_readers_keep_the_old_snapshot_while_one_thread_rebuilds(self):
+        from . import availability
+        old = availability.get_snapshot()
+        availability.invalidate()
+        entered, release = threading.Event(), threading.Event()
+        fresh = availability.Snapshot([], timezone.now())
+
+        def slow_load():
+            entered.set()
+            release.wait(5)
+            return fresh
+
+        with mock.patch.object(availability, '_load', side_effect=slow_load) as load:
+            refresher = threading.Thread(target=availability.get_snapshot)
+            refresher.start()
+            self.assertTrue(entered.wait(5))
+            self.assertIs(availability.get_snapshot(), old)   # not blocked behind the rebuild
+            release.set()
+            refresher.join(5)
+        self.assertEqual(load.call_count, 1)
+        self.assertIs(availability.get_snapshot(), fresh)
+
+    def test_catalog_changed_forces_rebuild(self):
+        from .inventory import apply_stock_batch
+        self.client.get('/api/variants/availability/', {'variants': self.v_l.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_stock_batch([{'sku': 'ARS-H-L', 'stock': 2}])
+        res = self.client.get('/api/variants/availability/', {'variants': self.v_l.id})
+        self.assertEqual(res.data['variants'][str(self.v_l.id)]['stock'], 2)
+
+    def test_checkout_still_checks_stock_exactly(self):
+        self.client.get('/api/variants/availability/', {'variants': self.v_m.id})
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), variant=self.v_m, quantity=5)
+        ProductVariant.objects.filter(pk=self.v_m.pk).update(stock=1)
+        res = self.client.get('/api/variants/availability/', {'variants': self.v_m.id})
+        self.assertEqual(res.data['variants'][str(self.v_m.id)]['stock'], 10)  # stale snapshot
+        self.client.force_authenticate(self.user)
+        res = self.client.post('/api/orders/', {'address': self.address.id}, format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('Left: 1', res.data['detail'])
+
+
+# ==================== PROMOTIONS ====================
+
+class PromotionEngineTests(StoreFixtureMixin, TestCase):
+    def setUp(self):
+        from . import promotions
+        self.make_catalog()
+        self.client = APIClient()
+        promotions.invalidate()
+        self.addCleanup(promotions.invalidate)  # rows vanish on rollback without a post_delete
+        self.chelsea = Team.objects.create(name='Chelsea', league=self.league)
+        self.blues = Product.objects.create(
+            title='Chelsea Home', slug='chelsea-home', description='', price=Decimal('3000.00'),
+            image='products/chelsea.jpg', category=self.category, team=self.chelsea)
+        self.v_blues = ProductVariant.objects.create(product=self.blues, size='M', stock=10, sku='CHE-H-M')
+
+    def listing(self, **params):
+        return {p['slug']: p for p in self.client.get('/api/products/', params).json()['results']}
+
+    def test_best_rule_wins_and_page_is_priced_in_one_pass(self):
+        Promotion.objects.create(name='PL week', kind='PERCENT', value=Decimal('10'), league=self.league)
+        Promotion.objects.create(name='Arsenal 500 off', kind='FIXED', value=Decimal('500'), team=self.team)
+        Promotion.objects.create(name='Later', kind='PERCENT', value=Decimal('90'), category=self.category,
+                                 starts_at=timezone.now() + timedelta(days=1))
+        self.client.get('/api/products/')  # compile once
+        with self.assertNumQueries(3):      # count + page + variants prefetch: no per-product pricing queries
+            rows = self.listing()
+        self.assertEqual(rows['arsenal-home']['effective_price'], '2000.00')
+        self.assertEqual(rows['arsenal-home']['promotion'], 'Arsenal 500 off')
+        self.assertEqual(rows['chelsea-home']['effective_price'], '2700.00')
+        self.assertEqual(rows['chelsea-home']['price'], '3000.00')
+
+    def test_filters_and_ordering_use_effective_price(self):
+        Promotion.objects.create(name='Blues half off', kind='PERCENT', value=Decimal('50'), product=self.blues)
+        self.assertEqual(list(self.listing(ordering='price')), ['chelsea-home', 'arsenal-home'])
+        self.assertEqual(list(self.listing(ordering='-price')), ['arsenal-home', 'chelsea-home'])
+        self.assertEqual(list(self.listing(price_max=2000)), ['chelsea-home'])
+        self.assertEqual(list(self.listing(price_min=1600)), ['arsenal-home'])
+
+    def test_rule_changes_recompile(self):
+        self.assertEqual(self.listing()['arsenal-home']['effective_price'], '2500.00')
+        promo = Promotion.objects.create(name='Flash', kind='PERCENT', value=Decimal('20'), team=self.team)
+        self.assertEqual(self.listing()['arsenal-home']['effective_price'], '2000.00')
+        promo.ends_at = timezone.now()
+        promo.save()
+        self.assertEqual(self.listing()['arsenal-home']['effective_price'], '2500.00')
+
+    def test_coupon_in_cart_and_checkout(self):
+        Promotion.objects.create(name='Match day', code='MATCHDAY', kind='PERCENT', value=Decimal('15'),
+                                 league=self.league)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, variant=self.v_m, quantity=2)
+        CartItem.objects.create(cart=cart, variant=self.v_blues, quantity=1)
+        self.client.force_authenticate(self.user)
+
+        plain = self.client.get('/api/cart/').json()
+        self.assertEqual((plain['cart_total'], plain['discount'], plain['coupon']), ('8000.00', '0.00', None))
+        res = self.client.get('/api/cart/', {'coupon': 'matchday'}).json()
+        self.assertEqual(res['cart_total'], '6800.00')
+        self.assertEqual(res['coupon'], {'code': 'MATCHDAY', 'valid': True})
+        self.assertEqual([i['unit_price'] for i in res['items']], ['2125.00', '2550.00'])
+        self.assertFalse(self.client.get('/api/cart/', {'coupon': 'nope'}).json()['coupon']['valid'])
+
+        bad = self.client.post('/api/orders/', {'address': self.address.id, 'coupon': 'nope'}, format='json')
+        self.assertEqual(bad.status_code, 400)
+        bad = self.client.post('/api/orders/', {'address': self.address.id, 'coupon': 123}, format='json')
+        self.assertEqual(bad.status_code, 400)
+        res = self.client.post('/api/orders/', {'address': self.address.id, 'coupon': 'MatchDay'}, format='json')
+        self.assertEqual(res.status_code, 201)
+        order = Order.objects.get(pk=res.json()['id'])
+        self.assertEqual(order.total, Decimal('6800.00'))
+        self.assertEqual(sorted(order.items.values_list('price', flat=True)), [Decimal('2125.00'), Decimal('2550.00')])
+
+    def test_checkout_uses_current_rules_not_the_cached_engine(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, variant=self.v_m, quantity=1)
+        self.client.get('/api/products/')  # engine compiled with no rules
+        Promotion.objects.bulk_create([Promotion(name='Silent', kind='FIXED', value=Decimal('100'))])  # no signal
+        self.client.force_authenticate(self.user)
+        res = self.client.post('/api/orders/', {'address': self.address.id}, format='json')
+        self.assertEqual(Decimal(res.json()['total']), Decimal('2400.00'))
+
+    def test_promotion_validation(self):
+        from django.core.exceptions import ValidationError
+        with self.assertRaises(ValidationError):
+            Promotion(name='x', kind='PERCENT', value=Decimal('120')).full_clean()
+        with self.assertRaises(ValidationError):
+            Promotion(name='x', kind='FIXED', value=Decimal('10'), team=self.team, league=self.league).full_clean()
+
+
+# ==================== CURRENCY ====================
+
+class CurrencyDisplayTests(StoreFixtureMixin, TestCase):
+    def setUp(self):
+        from . import currency
+        self.make_catalog()
+        self.client = APIClient()
+        currency.invalidate()
+        self.addCleanup(currency.invalidate)
+        ExchangeRate.objects.create(currency='USD', npr_per_unit=Decimal('133.5000'))
+        ExchangeRate.objects.create(currency='JPY', npr_per_unit=Decimal('0.8900'), decimals=0)
+
+    def test_product_grid_converted_in_place(self):
+        rows = self.client.get('/api/products/', {'currency': 'usd'})
+        self.assertEqual(rows['Content-Currency'], 'USD')
+        self.assertIn('Accept-Currency', rows['Vary'])
+        row = rows.json()['results'][0]
+        self.assertEqual((row['price'], row['effective_price'], row['currency']), ('18.73', '18.73', 'USD'))
+
+        row = self.client.get('/api/products/', HTTP_ACCEPT_CURRENCY='JPY').json()['results'][0]
+        self.assertEqual((row['price'], row['currency']), ('2809', 'JPY'))
+
+        row = self.client.get('/api/products/', {'currency': 'XXX'}).json()['results'][0]
+        self.assertEqual(row['price'], '2500.00')  # unknown -> NPR, untouched
+        self.assertNotIn('currency', row)
+
+    def test_rates_file_and_model_override(self):
+        from . import currency
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as fh:
+            json.dump({'rates': {'GBP': '170.00', 'USD': '999', 'AUD': {'npr_per_unit': '-1'}}}, fh)
+        self.addCleanup(os.unlink, fh.name)
+        with override_settings(CURRENCY={'RATES_FILE': fh.name}):
+            currency.invalidate()
+            with self.assertLogs('store.currency', 'WARNING'):
+                rates = currency.get_rates()
+            self.assertEqual(rates['GBP'], (Decimal('170.00'), Decimal('0.01')))
+            self.assertEqual(rates['USD'][0], Decimal('133.5000'))  # admin row wins
+            self.assertNotIn('AUD', rates)                          # bad entry skipped
+            res = self.client.get('/api/currencies/').json()
+            self.assertEqual(res['currencies'], ['NPR', 'GBP', 'JPY', 'USD'])
+        currency.invalidate()
+
+    def test_page_converted_in_one_pass_with_cached_rates(self):
+        from . import currency
+        currency.get_rates()
+        data = {'results': [{'price': '2500.00', 'nested': {'cart_total': Decimal('5000')}}, {'price': None}]}
+        with self.assertNumQueries(0), mock.patch.object(currency, 'convert_many', wraps=currency.convert_many) as conv:
+            currency.localize(data, ('price', 'cart_total'), 'USD')
+        conv.assert_called_once()
+        self.assertEqual(data['results'][0]['nested']['cart_total'], Decimal('37.45'))
+        self.assertIsNone(data['results'][1]['price'])
+        self.assertEqual(currency.convert_many(['1.335'], 'USD'), [Decimal('0.01')])  # half-up
+
+    def test_converted_cart_adds_up(self):
+        from . import promotions
+        self.addCleanup(promotions.invalidate)
+        Promotion.objects.create(name='Ten off', code='TEN', kind='PERCENT', value=Decimal('10'))
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, variant=self.v_m, quantity=2)
+        CartItem.objects.create(cart=cart, variant=self.v_l, quantity=1)
+        self.client.force_authenticate(self.user)
+
+        res = self.client.get('/api/cart/', {'currency': 'USD', 'coupon': 'TEN'}).json()
+        self.assertEqual([(i['product_price'], i['unit_price'], i['sub_total']) for i in res['items']],
+                         [('18.73', '16.85', '33.70'), ('18.73', '16.85', '16.85')])
+        self.assertEqual((res['subtotal'], res['discount'], res['cart_total']), ('56.19', '5.64', '50.55'))
+        self.assertEqual(sum(Decimal(i['sub_total']) for i in res['items']), Decimal(res['cart_total']))
+        self.assertEqual(Decimal(res['subtotal']) - Decimal(res['discount']), Decimal(res['cart_total']))
+
+    def test_cart_converted_but_checkout_and_gateway_settle_in_npr(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, variant=self.v_m, quantity=2)
+        self.client.force_authenticate(self.user)
+
+        res = self.client.get('/api/cart/', {'currency': 'USD'}).json()
+        self.assertEqual((res['cart_total'], res['discount'], res['currency']), ('37.46', '0.00', 'USD'))
+        self.assertEqual(res['items'][0]['sub_total'], '37.46')  # 2 x 18.73, as shown per unit
+
+        res = self.client.post('/api/orders/?currency=USD', {'address': self.address.id}, format='json').json()
+        self.assertEqual((res['total'], res['display_total'], res['display_currency']), ('5000.00', '37.46', 'USD'))
+        self.assertEqual(sum(Decimal(i['display_price']) * i['quantity'] for i in res['items']),
+                         Decimal(res['display_total']))   # same figures the cart showed
+        self.assertEqual(Order.objects.get(pk=res['id']).total, Decimal('5000.00'))
+
+        with mock.patch('requests.post') as post:
+            post.return_value = mock.Mock(status_code=200, json=lambda: {'pidx': 'P1', 'payment_url': 'https://pay/1'})
+            self.client.post(f"/api/payments/khalti/initiate/{res['id']}/", HTTP_ACCEPT_CURRENCY='USD')
+        self.assertEqual(post.call_args.kwargs['json']['amount'], 500000)  # paisa
+
+
+# ==================== SETTINGS / CACHES ====================
+
+class ConfTests(TestCase):
+    def test_settings_override_only_the_keys_they_set(self):
+        from . import conf
+        with override_settings(CURRENCY={'TTL': 5}):
+            self.assertEqual(conf.get('CURRENCY'), {**conf.DEFAULTS['CURRENCY'], 'TTL': 5})
+
+    def test_cached_reloads_after_ttl_expiry_or_invalidate(self):
+        from . import conf
+        loads = []
+        cache = conf.Cached(lambda: loads.append(1) or len(loads), 'CURRENCY', expired=lambda v: v == 3)
+        self.assertEqual((cache.get(), cache.get()), (1, 1))
+        cache.invalidate()
+        self.assertEqual(cache.get(), 2)
+        with override_settings(CURRENCY={'TTL': 0}):
+            self.assertEqual(cache.get(), 3)
+        self.assertEqual(cache.get(), 4)   # 3 reported itself expired
+        cache.set(10)
+        self.assertEqual(cache.get(), 10)
@@ -0,0 +1,227 @@
+# store/throttling.py
+"""
+Token-bucket throttling with per-endpoint costs and a store shared by all workers.
+
+Every client (user id, or IP for anonymous requests) owns a bucket of `capacity`
+tokens refilled at `rate` tokens/second; each request spends the cost configured for
+its endpoint (settings.TOKEN_BUCKET['COSTS'], default 1).  Expensive endpoints also
+draw from GLOBAL buckets shared by every client: when a drop floods checkout, requests
+queue briefly for a token and are then shed with 429 before they reach the DB locks.
+
+A decision is one primary-key read + upsert on the bucket store, i.e. O(1).
+"""
+import itertools
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+from . import conf
+
+
+# --------------------------
+# Stores
+# --------------------------
+def _refill(tokens, updated, now, capacity, rate):
+    if tokens is None:
+        return float(capacity)
+    return min(float(capacity), tokens + max(0.0, now - updated) * rate)
+
+
+def _decide(tokens, cost, rate):
+    """(allowed, tokens_after, retry_after_seconds)"""
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    return False, tokens, (cost - tokens) / rate if rate > 0 else float('inf')
+
+
+class LocalBucketStore:
+    """
+    Per-process buckets (development, tests, single-worker deployments).
+    An LRU of at most `max_entries` keys: the least recently seen client's bucket is
+    dropped first, and it has usually refilled completely by then anyway.
+    """
+
+    def __init__(self, max_entries=100000, **options):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, cost, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (None, now))
+            tokens = _refill(tokens, updated, now, capacity, rate)
+            allowed, tokens, retry = _decide(tokens, cost, rate)
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return allowed, retry
+
+    def refund(self, key, cost, capacity):
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(float(capacity), tokens + cost), updated)
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteBucketStore:
+    """
+    Buckets in a small SQLite file shared by every worker on the host.
+    Kept apart from the main database so throttling never contends with checkout writes.
+    BEGIN IMMEDIATE makes read-refill-write atomic across processes.  Every `prune_every`
+    decisions a worker deletes the buckets idle for a day, so the table stays bounded.
+    """
+
+    def __init__(self, path, timeout=0.5, prune_every=10000, **options):
+        self.path = str(path)
+        self.timeout = timeout
+        self.prune_every = prune_every
+        self._decisions = itertools.count(1)
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets '
+                         '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            self._local.conn = conn
+        return conn
+
+    def consume(self, key, cost, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        conn = self._conn()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = _refill(row[0] if row else None, row[1] if row else now, now, capacity, rate)
+            allowed, tokens, retry = _decide(tokens, cost, rate)
+            conn.execute('INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                         'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                         (key, tokens, now))
+            conn.execute('COMMIT')
+            if self.prune_every and next(self._decisions) % self.prune_every == 0:
+                self.prune()
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            return True, 0.0  # fail open: a busy throttle store must not take the API down
+        return allowed, retry
+
+    def refund(self, key, cost, capacity):
+        try:
+            self._conn().execute('UPDATE buckets SET tokens = MIN(?, tokens + ?) WHERE key = ?',
+                                 (float(capacity), cost, key))
+        except sqlite3.Error:
+            pass  # best effort, like consume() failing open
+
+    def prune(self, idle_seconds=86400):
+        """Drop buckets idle long enough to be full again anyway."""
+        conn = self._conn()
+        return conn.execute('DELETE FROM buckets WHERE updated < ?', (time.time() - idle_seconds,)).rowcount
+
+    def reset(self):
+        self._conn().execute('DELETE FROM buckets')
+
+
+# --------------------------
+# Config / store resolution
+# --------------------------
+STORE_OPTIONS = ('PATH', 'TIMEOUT', 'MAX_ENTRIES', 'PRUNE_EVERY')   # passed to the store, lower-cased
+_store = None
+_store_lock = threading.Lock()
+_queue = {}  # global bucket name -> requests currently waiting for a token
+_queue_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                cfg = conf.get('TOKEN_BUCKET')
+                options = {k.lower(): v for k, v in cfg.items() if k in STORE_OPTIONS}
+                _store = import_string(cfg['STORE'])(**options)
+    return _store
+
+
+@receiver(setting_changed)
+def _reset_store(setting, **kwargs):
+    global _store
+    if setting == 'TOKEN_BUCKET':
+        _store = None
+
+
+def endpoint_name(view):
+    """'OrderViewSet.create' for viewset actions, else the view class / function name."""
+    name = type(view).__name__
+    action = getattr(view, 'action', None)
+    return f'{name}.{action}' if action else name
+
+
+# --------------------------
+# DRF throttle
+# --------------------------
+class TokenBucketThrottle(BaseThrottle):
+    def allow_request(self, request, view):
+        cfg = conf.get('TOKEN_BUCKET')
+        store = get_store()
+        endpoint = endpoint_name(view)
+        cost = cfg['COSTS'].get(endpoint, 1)
+        self.retry_after = None
+
+        if request.user and request.user.is_authenticated:
+            bucket, key = cfg['USER'], f'user:{request.user.pk}'
+        else:
+            bucket, key = cfg['ANON'], f'anon:{self.get_ident(request)}'
+        allowed, retry = store.consume(key, cost, bucket['capacity'], bucket['rate'])
+        if not allowed:
+            self.retry_after = retry
+            return False
+
+        for name, g in cfg['GLOBAL'].items():
+            if endpoint in g.get('endpoints', ()) and not self._take_global(store, name, g):
+                # shed before the view ran: don't bill the client for it
+                store.refund(key, cost, bucket['capacity'])
+                return False
+        return True
+
+    def _take_global(self, store, name, g):
+        # global buckets count requests (cost 1), sized to what the DB can absorb
+        key = f'global:{name}'
+        allowed, retry = store.consume(key, 1, g['capacity'], g['rate'])
+        if allowed:
+            return True
+        # brief bounded queue: absorb a burst instead of bouncing it, shed once the queue is full
+        if retry > g.get('max_wait', 0):
+            self.retry_after = retry
+            return False
+        with _queue_lock:
+            if _queue.get(name, 0) >= g.get('max_queue', 0):
+                self.retry_after = retry
+                return False
+            _queue[name] = _queue.get(name, 0) + 1
+        try:
+            time.sleep(retry)
+            allowed, retry = store.consume(key, 1, g['capacity'], g['rate'])
+        finally:
+            with _queue_lock:
+                _queue[name] -= 1
+        if not allowed:
+            self.retry_after = retry
+        return allowed
+
+    def wait(self):
+        return self.retry_after
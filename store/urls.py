@@ -3,13 +3,15 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     ProductViewSet, CategoryViewSet, CartViewSet,
-    AddressViewSet, OrderViewSet, register, LoginAndMergeTokenView
+    AddressViewSet, OrderViewSet, register, LoginAndMergeTokenView, currencies,
 )
 from rest_framework_simplejwt.views import TokenRefreshView
 from .views_payments import (
     khalti_initiate, khalti_callback,
-    esewa_initiate, esewa_success, esewa_failure,
+    esewa_initiate, esewa_success, esewa_failure, payment_options,
 )
+from .views_analytics import sales_rollup
+from .views_inventory import stock_adjust, variant_availability
 
 router = DefaultRouter()
 router.register('products', ProductViewSet, basename='product')
@@ -24,15 +26,23 @@ urlpatterns = [
     path('cart/update-qty/', CartViewSet.as_view({'post': 'update_qty'})),
     path('cart/remove/', CartViewSet.as_view({'post': 'remove'})),
 
+    # Availability (size x stock for many products / variants)
+    path('variants/availability/', variant_availability),
+
+    # Display currencies (?currency= / Accept-Currency on products, cart, orders)
+    path('currencies/', currencies),
+
     # Addresses
     path('addresses/', AddressViewSet.as_view({'get': 'list', 'post': 'create'})),
 
     # Orders
     path('orders/', OrderViewSet.as_view({'post': 'create'})),
+    path('orders/bulk-transition/', OrderViewSet.as_view({'post': 'bulk_transition'})),
     path('orders/<int:pk>/pay/', OrderViewSet.as_view({'post': 'pay'})),
     path('orders/<int:pk>/mark-paid/', OrderViewSet.as_view({'post': 'mark_paid'})),
     path('orders/<int:pk>/upload-bank-proof/', OrderViewSet.as_view({'post': 'upload_bank_proof'})),
     path('orders/<int:pk>/verify-payment/', OrderViewSet.as_view({'post': 'verify_payment'})),
+    path('orders/<int:pk>/events/', OrderViewSet.as_view({'get': 'events'})),
 
     # Auth
     path('auth/register/', register),
@@ -40,9 +50,16 @@ urlpatterns = [
     path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
     # Payments
+    path('payments/options/', payment_options),
     path('payments/khalti/initiate/<int:order_id>/', khalti_initiate),
     path('payments/khalti/callback/', khalti_callback),
     path('payments/esewa/initiate/<int:order_id>/', esewa_initiate),
     path('payments/esewa/success/', esewa_success),
     path('payments/esewa/failure/', esewa_failure),
+
+    # Inventory (staff)
+    path('inventory/stock/', stock_adjust),
+
+    # Analytics (staff)
+    path('analytics/sales/', sales_rollup),
 ]
\ No newline at end of file
@@ -1,33 +1,42 @@
 from rest_framework import viewsets, filters, status
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.decorators import action, api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
 from django.db import transaction
 
 from .models import (Product, Category, ProductVariant, Cart, CartItem,
-                     Address, Order, OrderItem, Payment)
+                     Address, Order, OrderItem, Payment, ProductRelation, OrderEvent)
 from .serializers import (ProductSerializer, CategorySerializer, CartSerializer,
-                          AddressSerializer, OrderSerializer)
+                          AddressSerializer, OrderSerializer, RelatedProductSerializer,
+                          OrderEventSerializer)
+from . import audit, currency, promotions
+from .currency import CurrencyDisplayMixin
+from .order_states import InvalidTransition, bulk_transition, transition
+from .idempotency import idempotent
 
 # --------- Products ----------
-class ProductViewSet(viewsets.ReadOnlyModelViewSet):
+class ProductViewSet(CurrencyDisplayMixin, viewsets.ReadOnlyModelViewSet):
     """
     GET /api/products/
       ?search=manchester
       &category=club-jerseys          # slug
       &team=1                         # team id
       &league=1                       # league id
-      &price_min=1000&price_max=5000
+      &price_min=1000&price_max=5000       # effective (promotion) price
       &ordering=price| -price | created | -created | title | -title
+      &coupon=MATCHDAY                      # show coupon prices too
+      &currency=USD  (or Accept-Currency: USD) # display prices converted from NPR
     """
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
     lookup_field = 'slug'
     filter_backends = [filters.SearchFilter]
     search_fields = ['title', 'slug', 'team__name', 'category__name']
+    currency_fields = ('price', 'effective_price')
 
     def get_queryset(self):
         qs = (Product.objects
@@ -49,15 +58,17 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
             qs = qs.filter(team_id=team)
         if league:
             qs = qs.filter(team__league_id=league)
+        # effective price = list price after the best live promotion (store/promotions.py)
+        qs = qs.annotate(effective_price=promotions.price_expression(req.query_params.get('coupon')))
         if price_min:
-            qs = qs.filter(price__gte=price_min)
+            qs = qs.filter(effective_price__gte=price_min)
         if price_max:
-            qs = qs.filter(price__lte=price_max)
+            qs = qs.filter(effective_price__lte=price_max)
 
         # safe ordering map to avoid arbitrary field orderings
         order_map = {
-            'price': 'price',
-            '-price': '-price',
+            'price': 'effective_price',
+            '-price': '-effective_price',
             'created': 'created_at',
             '-created': '-created_at',
             'title': 'title',
@@ -69,6 +80,35 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
             qs = qs.order_by('-created_at')
 
         return qs
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'coupon': self.request.query_params.get('coupon')}
+
+    def get_serializer(self, *args, **kwargs):
+        # a whole page is priced in one pass instead of per product
+        if kwargs.get('many') and args:
+            products = list(args[0])
+            kwargs['context'] = {**self.get_serializer_context(),
+                                 'prices': promotions.evaluate(products, code=self.request.query_params.get('coupon'))}
+            args = (products, *args[1:])
+        return super().get_serializer(*args, **kwargs)
+
+    @action(detail=True, methods=['get'])
+    def related(self, request, slug=None):
+        """
+        GET /api/products/{slug}/related/ -> precomputed "fans also bought" list
+        (one indexed query on ProductRelation(product, rank); build with build_related_products).
+        """
+        rels = (ProductRelation.objects
+                .filter(product__slug=slug, related__is_active=True)
+                .select_related('related__team')
+                .order_by('rank'))
+        products = [r.related for r in rels]
+        if not products:
+            # only now pay for the existence check: unknown slugs are 404 like retrieve()
+            get_object_or_404(Product, slug=slug, is_active=True)
+        context = {'request': request, 'prices': promotions.evaluate(products)}
+        return Response(RelatedProductSerializer(products, many=True, context=context).data)
     
 # --------- Categories ----------
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
@@ -77,8 +117,12 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [AllowAny]
 
 # --------- Cart (guest via X-Session-Id) ----------
-class CartViewSet(viewsets.ViewSet):
+class CartViewSet(CurrencyDisplayMixin, viewsets.ViewSet):
     permission_classes = [AllowAny]
+    currency_fields = ('product_price', 'unit_price', 'sub_total', 'subtotal', 'discount', 'cart_total')
+
+    def localize_response(self, data, code):
+        return currency.localize_cart(data, code)
 
     def _get_cart(self, request):
         # JWT users: bind to user cart
@@ -96,7 +140,7 @@ class CartViewSet(viewsets.ViewSet):
         cart = self._get_cart(request)
         if not cart:
             return Response({'detail':'Missing X-Session-Id header'}, status=400)
-        return Response(CartSerializer(cart).data)
+        return Response(CartSerializer(cart, context={'coupon': request.query_params.get('coupon')}).data)
 
     @action(detail=False, methods=['post'])
     def add(self, request):
@@ -152,9 +196,16 @@ class AddressViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 # --------- Orders (JWT) ----------
-class OrderViewSet(viewsets.ViewSet):
+class OrderViewSet(CurrencyDisplayMixin, viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
+    # orders are charged in NPR: show display_total / display_price next to the real amounts
+    currency_fields = ('total', 'price')
+    currency_actions = ('create',)
 
+    def localize_response(self, data, code):
+        return currency.localize_order(data, code)
+
+    @idempotent('checkout')
     @transaction.atomic
     def create(self, request):
         # Always checkout the **user** cart
@@ -164,26 +215,36 @@ class OrderViewSet(viewsets.ViewSet):
         address_id = request.data.get('address')
         address = get_object_or_404(Address, pk=address_id, user=request.user)
 
+        # prices are charged from freshly compiled promotion rules, never a cached view
+        coupon = request.data.get('coupon')
+        if coupon is not None and not isinstance(coupon, str):
+            return Response({'detail': 'coupon must be a string'}, status=400)
+        engine = promotions.get_engine(fresh=True)
+        if coupon and not engine.has_code(coupon):
+            return Response({'detail': 'Invalid or expired coupon'}, status=400)
+
         # lock variants to avoid race conditions
         variant_ids = list(cart.items.values_list('variant_id', flat=True))
         variants_qs = ProductVariant.objects.select_for_update().select_related('product').filter(id__in=variant_ids)
         variants_map = {v.id: v for v in variants_qs}
 
-        total = 0
-        for it in cart.items.select_related('variant__product'):
-            v = variants_map[it.variant_id]
+        items = list(cart.items.all())
+        for it in items:
+            it.variant = v = variants_map[it.variant_id]
             if it.quantity > v.stock:
                 return Response({'detail': f'Insufficient stock for {v.product.title} ({v.size}). Left: {v.stock}'}, status=400)
-            total += it.quantity * v.product.price
+        q = promotions.quote(items, code=coupon, engine=engine)
 
-        order = Order.objects.create(user=request.user, address=address, total=total)
-        for it in cart.items.all():
-            v = variants_map[it.variant_id]
-            OrderItem.objects.create(order=order, variant=v, price=v.product.price, quantity=it.quantity)
-            v.stock -= it.quantity
-            v.save()
+        order = Order.objects.create(user=request.user, address=address, total=q.total)
+        for it, price in q.lines:
+            OrderItem.objects.create(order=order, variant=it.variant, price=price.price, quantity=it.quantity)
+            it.variant.stock -= it.quantity
+            it.variant.save()
 
         cart.items.all().delete()
+        audit.record(order.id, 'order.created', total=order.total, discount=q.discount,
+                     coupon=promotions.normalize_code(coupon) or None,
+                     promotions=sorted({p.promotion.id for _, p in q.lines if p.promotion}))
         return Response(OrderSerializer(order).data, status=201)
 
     @action(detail=True, methods=['post'])
@@ -194,6 +255,7 @@ class OrderViewSet(viewsets.ViewSet):
         Payment.objects.update_or_create(order=order, defaults={
             'provider': provider, 'reference': reference, 'amount': order.total, 'is_verified': False
         })
+        audit.record(order.id, 'payment.created', provider=provider, reference=reference)
         return Response({'ok': True, 'message': 'Payment created. Verify via webhook in production.'})
 
     @action(detail=True, methods=['post'])
@@ -201,12 +263,56 @@ class OrderViewSet(viewsets.ViewSet):
         order = get_object_or_404(Order, pk=pk, user=request.user)
         if not hasattr(order, 'payment'):
             return Response({'detail': 'No payment created'}, status=400)
-        order.payment.is_verified = True
-        order.payment.save()
-        order.status = 'PAID'
-        order.save()
+        try:
+            with transaction.atomic():
+                transition(order, 'PAID', by='mark_paid')
+                order.payment.is_verified = True
+                order.payment.save()
+        except InvalidTransition as e:
+            return Response({'detail': str(e)}, status=400)
         return Response({'ok': True})
 
+    @action(detail=False, methods=['post'])
+    def bulk_transition(self, request):
+        """
+        Staff: POST /api/orders/bulk-transition/ {"ids": [...], "to": "SHIPPED", "from": "PAID"}
+        ("from" is optional). Returns a result per order id.
+        """
+        if not request.user.is_staff:
+            return Response({'detail': 'Admin access required'}, status=403)
+        ids, to = request.data.get('ids'), request.data.get('to')
+        if not isinstance(ids, list) or not ids or len(ids) > 20000:
+            return Response({'detail': 'ids must be a list of 1..20000 order ids'}, status=400)
+        try:
+            results = bulk_transition(ids, to, expected=request.data.get('from'), by=f'staff:{request.user.pk}')
+        except (InvalidTransition, TypeError, ValueError) as e:
+            return Response({'detail': str(e)}, status=400)
+        moved = sum(1 for r in results.values() if r['status'] == 'ok')
+        return Response({'moved': moved, 'results': {str(k): v for k, v in results.items()}})
+
+    @action(detail=True, methods=['get'])
+    def events(self, request, pk=None):
+        """Audit trail (status transitions + raw gateway responses), oldest first. Owner or staff."""
+        lookup = {'pk': pk} if request.user.is_staff else {'pk': pk, 'user': request.user}
+        order = get_object_or_404(Order.objects.only('id'), **lookup)
+        audit.flush()  # include events this worker has not written yet
+        events = OrderEvent.objects.filter(order=order).order_by('created_at', 'id')
+        return Response(OrderEventSerializer(events, many=True).data)
+
+# --------- Display currencies ----------
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def currencies(request):
+    """GET /api/currencies/ -> display currencies and their NPR rates (payments always settle in NPR)."""
+    rates = currency.get_rates()
+    return Response({
+        'base': currency.BASE,
+        'currencies': currency.available(),
+        'rates': {code: {'npr_per_unit': rate, 'decimals': max(0, -quantum.as_tuple().exponent)}
+                  for code, (rate, quantum) in sorted(rates.items())},
+    })
+
 # --------- Register (simple) ----------
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -226,11 +332,14 @@ class LoginAndMergeTokenView(TokenObtainPairView):
     On successful login, if request has X-Session-Id (guest cart), merge into user's cart.
     """
     def post(self, request, *args, **kwargs):
-        response = super().post(request, *args, **kwargs)  # get tokens first
-        # if token creation failed, DRF already returned error
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0]) from e
+        # the serializer already loaded the authenticated user; no second lookup by username
+        user = serializer.user
         try:
-            username = request.data.get('username')
-            user = User.objects.get(username=username)
             session_id = request.headers.get('X-Session-Id')
             if session_id:
                 guest_cart = Cart.objects.filter(session_id=session_id).first()
@@ -240,7 +349,7 @@ class LoginAndMergeTokenView(TokenObtainPairView):
                     for it in guest_cart.items.select_related('variant__product'):
                         v = it.variant
                         existing, created = CartItem.objects.get_or_create(cart=user_cart, variant=v)
-                        new_qty = existing.quantity + it.quantity
+                        new_qty = existing.quantity + it.quantity if not created else it.quantity
                         existing.quantity = min(new_qty, v.stock)
                         existing.save()
                     guest_cart.items.all().delete()
@@ -248,7 +357,7 @@ class LoginAndMergeTokenView(TokenObtainPairView):
         except Exception:
             # don't break login if merge has issues
             pass
-        return response
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
 # Add to the end of views.py
 
 @action(detail=True, methods=['post'])
@@ -283,10 +392,13 @@ def verify_payment(self, request, pk=None):
     order = get_object_or_404(Order, pk=pk)
     
     if hasattr(order, 'payment'):
-        order.payment.is_verified = True
-        order.payment.save()
-        order.status = 'PAID'
-        order.save()
+        try:
+            with transaction.atomic():
+                transition(order, 'PAID', by=f'staff:{request.user.pk}')
+                order.payment.is_verified = True
+                order.payment.save()
+        except InvalidTransition as e:
+            return Response({'detail': str(e)}, status=400)
         return Response({'ok': True, 'message': 'Payment verified'})
     
     return Response({'detail': 'No payment record found'}, status=400)
@@ -0,0 +1,81 @@
+# store/views_analytics.py
+from django.db.models import Sum
+from django.utils.dateparse import parse_date
+from rest_framework import serializers
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from .models import DailySalesRollup
+
+# group_by dimension -> rollup columns returned for it
+GROUP_FIELDS = {
+    'date': ['date'],
+    'product': ['product_id', 'product__title'],
+    'size': ['size'],
+    'team': ['team_id', 'team__name'],
+    'league': ['league_id', 'league__name'],
+    'category': ['category_id', 'category__slug'],
+    'provider': ['provider'],
+}
+
+
+# Sum() gives a bare Decimal, which the JSON renderer would emit as a float
+REVENUE = serializers.DecimalField(max_digits=None, decimal_places=2)
+
+
+def _parse_day(value):
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def sales_rollup(request):
+    """
+    Staff analytics answered from DailySalesRollup only (never scans OrderItem).
+    GET /api/analytics/sales/
+      ?start=2025-01-01&end=2025-01-31
+      &group_by=date,team             # any of: date, product, size, team, league, category, provider
+      &team=1&league=1&category=club-jerseys&provider=KHALTI&size=M
+    """
+    p = request.query_params
+    qs = DailySalesRollup.objects.all()
+
+    for name, lookup in (('start', 'date__gte'), ('end', 'date__lte')):
+        if p.get(name):
+            day = _parse_day(p[name])
+            if day is None:
+                return Response({'detail': f'{name} must be YYYY-MM-DD'}, status=400)
+            qs = qs.filter(**{lookup: day})
+
+    for name in ('team', 'league'):
+        if p.get(name):
+            try:
+                qs = qs.filter(**{f'{name}_id': int(p[name])})
+            except ValueError:
+                return Response({'detail': f'{name} must be an integer id'}, status=400)
+    if p.get('category'):
+        qs = qs.filter(category__slug=p['category'])
+    if p.get('provider'):
+        qs = qs.filter(provider=p['provider'].upper())
+    if p.get('size'):
+        qs = qs.filter(size=p['size'])
+
+    dims = [d for d in p.get('group_by', 'date').split(',') if d]
+    unknown = [d for d in dims if d not in GROUP_FIELDS]
+    if unknown:
+        return Response({'detail': f'Unknown group_by: {", ".join(unknown)}'}, status=400)
+    fields = [f for d in dims for f in GROUP_FIELDS[d]]
+
+    totals = {'units': Sum('units'), 'revenue': Sum('revenue')}
+    if fields:
+        rows = list(qs.values(*fields).annotate(**totals).order_by(*fields))
+    else:
+        rows = [qs.aggregate(**totals)]
+    for row in rows:
+        if row['revenue'] is not None:
+            row['revenue'] = REVENUE.to_representation(row['revenue'])
+    return Response({'group_by': dims, 'results': rows})
@@ -0,0 +1,64 @@
+# store/views_inventory.py
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.response import Response
+
+from . import availability
+from .inventory import apply_stock_batch
+
+MAX_BATCH = 20000
+MAX_AVAILABILITY_KEYS = 500
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def stock_adjust(request):
+    """
+    Warehouse sync: POST /api/inventory/stock/
+      {"entries": [{"sku": "ARS-H-M", "stock": 40}, {"sku": "ARS-H-L", "delta": -3}, ...]}
+    (a bare JSON list is accepted too).  Returns one result per entry, in order.
+    """
+    entries = request.data if isinstance(request.data, list) else request.data.get('entries')
+    if not isinstance(entries, list) or not entries:
+        return Response({'detail': 'entries must be a non-empty list'}, status=400)
+    if len(entries) > MAX_BATCH:
+        return Response({'detail': f'at most {MAX_BATCH} entries per batch'}, status=400)
+    return Response(apply_stock_batch(entries))
+
+
+def _keys(request, name):
+    if request.method == 'POST':
+        value = request.data.get(name) or []
+        return value if isinstance(value, list) else None
+    return [v for v in request.query_params.get(name, '').split(',') if v.strip()]
+
+
+@api_view(['GET', 'POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def variant_availability(request):
+    """
+    Size x stock matrix for many products and/or variants at once:
+      GET  /api/variants/availability/?products=arsenal-home,chelsea-away&variants=12,13
+      POST /api/variants/availability/  {"products": [...], "variants": [...]}  (long cart lists)
+    Served from a snapshot at most `max_age` seconds old; checkout re-checks stock exactly.
+    """
+    if request.method == 'POST' and not isinstance(request.data, dict):
+        return Response({'detail': 'body must be an object: {"products": [...], "variants": [...]}'}, status=400)
+    slugs, ids = _keys(request, 'products'), _keys(request, 'variants')
+    if slugs is None or ids is None:
+        return Response({'detail': 'products and variants must be lists'}, status=400)
+    if not slugs and not ids:
+        return Response({'detail': 'pass products (slugs) and/or variants (ids)'}, status=400)
+    if len(slugs) + len(ids) > MAX_AVAILABILITY_KEYS:
+        return Response({'detail': f'at most {MAX_AVAILABILITY_KEYS} products + variants per call'}, status=400)
+    try:
+        ids = [int(v) for v in ids]
+    except (TypeError, ValueError):
+        return Response({'detail': 'variants must be integer ids'}, status=400)
+
+    data = availability.lookup([str(s).strip() for s in slugs], ids)
+    response = Response(data)
+    if request.method == 'GET':
+        response['Cache-Control'] = f"public, max-age={data['max_age']}"
+    return response
@@ -1,19 +1,31 @@
 # store/views_payments.py
 import base64, hmac, hashlib, uuid
-import requests
 from decimal import Decimal
 from django.conf import settings
 from django.shortcuts import get_object_or_404, redirect
-from rest_framework.decorators import api_view, permission_classes
+from django.utils.cache import patch_cache_control
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status as drf_status
 
 from .models import Order, Payment
+from . import audit
+from .order_states import InvalidTransition, transition
+from .idempotency import idempotent
+from .payment_config import payment_options as cached_payment_options
+
+PAYMENT_OPTIONS_MAX_AGE = 3600  # seconds; clients revalidate cheaply with the ETag afterwards
 
 # --------------------------
 # Helpers
 # --------------------------
+def _http():
+    # `requests` (+ urllib3, charset_normalizer) is only needed by the gateway calls,
+    # so this module doesn't pay for it at import time
+    import requests
+    return requests
+
 def _amount_paisa(amount_decimal: Decimal) -> int:
     # Khalti needs amount in paisa (NPR * 100)
     return int(Decimal(amount_decimal) * 100)
@@ -24,12 +36,42 @@ def _sign_esewa(total_amount: str, transaction_uuid: str, product_code: str, sec
     digest = hmac.new(secret_key.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).digest()
     return base64.b64encode(digest).decode('utf-8')
 
+def _mark_order_paid(order, by):
+    # the gateway has the money either way; a rejected move (e.g. order cancelled meanwhile)
+    # is kept in the audit trail for staff to refund
+    try:
+        transition(order, "PAID", by=by)
+    except InvalidTransition as e:
+        audit.record(order.id, 'order.transition_rejected', to="PAID", by=by, reason=str(e))
+
+# --------------------------
+# Checkout payment options (QR codes, account details)
+# --------------------------
+
+@api_view(['GET'])
+@authentication_classes([])  # public + identical for everyone: skip the JWT user lookup
+@permission_classes([AllowAny])
+def payment_options(request):
+    """
+    Served from the in-process cache in store.payment_config (no DB query once warm).
+    Supports If-None-Match -> 304 and long-lived public caching.
+    """
+    payload, etag = cached_payment_options(f"{request.scheme}://{request.get_host()}")
+    if request.headers.get('If-None-Match') == etag:
+        response = Response(status=304)
+    else:
+        response = Response(payload)
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=PAYMENT_OPTIONS_MAX_AGE)
+    return response
+
 # --------------------------
 # KHALTI
 # --------------------------
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('khalti_initiate')
 def khalti_initiate(request, order_id: int):
     """
     Create a Khalti payment, return redirect URL (payment_url) and pidx.
@@ -54,8 +96,16 @@ def khalti_initiate(request, order_id: int):
             "phone": "9800000001",  # Optional: capture phone on checkout
         },
     }
-    r = requests.post(url, json=payload, headers=headers, timeout=30)
-    data = r.json()
+    r = _http().post(url, json=payload, headers=headers, timeout=30)
+    try:
+        data = r.json()
+    except ValueError:  # outage pages are HTML
+        data = {}
+    audit.record(order.id, 'gateway.khalti.initiate', http=r.status_code, response=data)
+    if r.status_code >= 500:
+        # gateway outage: 502 so the Idempotency-Key claim is released and a retry calls Khalti again
+        return Response({"detail": "Khalti is unavailable, try again", "provider_response": data},
+                        status=drf_status.HTTP_502_BAD_GATEWAY)
     if r.status_code >= 400:
         return Response({"detail": "Khalti initiate failed", "provider_response": data}, status=drf_status.HTTP_400_BAD_REQUEST)
 
@@ -87,7 +137,7 @@ def khalti_callback(request):
     base = settings.KHALTI_BASE_URL.rstrip('/')
     url = f"{base}/epayment/lookup/"
     headers = {"Authorization": f"Key {settings.KHALTI_SECRET_KEY}", "Content-Type": "application/json"}
-    r = requests.post(url, json={"pidx": pidx}, headers=headers, timeout=30)
+    r = _http().post(url, json={"pidx": pidx}, headers=headers, timeout=30)
     data = r.json()
 
     # find payment by pidx
@@ -96,6 +146,7 @@ def khalti_callback(request):
         return Response({"detail": "Payment not found"}, status=404)
 
     # update
+    audit.record(pay.order_id, 'gateway.khalti.lookup', http=r.status_code, response=data)
     pay.meta = data
     status_text = (data.get("status") or "").lower()
     if status_text == "completed" and Decimal(data.get("total_amount", 0)) == Decimal(_amount_paisa(pay.amount)):
@@ -103,9 +154,7 @@ def khalti_callback(request):
         pay.reference = data.get("transaction_id") or ""
         pay.save()
         # mark order PAID
-        o = pay.order
-        o.status = "PAID"
-        o.save()
+        _mark_order_paid(pay.order, by="khalti")
         # redirect to your frontend success page (optional)
         return redirect(settings.FRONTEND_ORIGIN)  # or return JSON
     else:
@@ -120,6 +169,7 @@ def khalti_callback(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('esewa_initiate')
 def esewa_initiate(request, order_id: int):
     """
     Return a signed form payload for eSewa EPAY v2.
@@ -147,6 +197,7 @@ def esewa_initiate(request, order_id: int):
     pay.transaction_uuid = transaction_uuid
     pay.meta = {"signature": signature}
     pay.save()
+    audit.record(order.id, 'gateway.esewa.initiate', transaction_uuid=transaction_uuid, amount=total_amount)
 
     form_fields = {
         "amount": total_amount,
@@ -183,8 +234,9 @@ def esewa_success(request):
     status_url = settings.ESEWA_STATUS_URL
     # GET ?product_code=...&total_amount=...&transaction_uuid=...
     verify_url = f"{status_url}?product_code={settings.ESEWA_PRODUCT_CODE}&total_amount={total_amount}&transaction_uuid={transaction_uuid}"
-    r = requests.get(verify_url, timeout=30)
+    r = _http().get(verify_url, timeout=30)
     data = r.json() if r.headers.get('content-type','').startswith('application/json') else {}
+    audit.record(pay.order_id, 'gateway.esewa.status', http=r.status_code, response=data)
     pay.meta = {"status_response": data}
     status_text = (data.get("status") or "").upper()
 
@@ -192,9 +244,7 @@ def esewa_success(request):
         pay.is_verified = True
         pay.reference = data.get("refId") or ""
         pay.save()
-        o = pay.order
-        o.status = "PAID"
-        o.save()
+        _mark_order_paid(pay.order, by="esewa")
         return redirect(settings.FRONTEND_ORIGIN)  # success page
     else:
         pay.is_verified = False
@@ -204,5 +254,11 @@ def esewa_success(request):
 @api_view(['GET', 'POST'])
 @permission_classes([AllowAny])
 def esewa_failure(request):
-    # You can log details from query/body for audit
+    params = request.data if request.method == 'POST' else request.query_params
+    transaction_uuid = params.get("transaction_uuid")
+    order_id = None
+    if transaction_uuid:
+        order_id = (Payment.objects.filter(transaction_uuid=transaction_uuid, provider="esewa")
+                    .values_list("order_id", flat=True).first())
+    audit.record(order_id, 'gateway.esewa.failure', params=dict(params.items()))
     return redirect(settings.FRONTEND_ORIGIN)